@@ -5,8 +5,18 @@ import sqlite3
 import json
 import logging
 import csv
-from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, List
+import calendar
+import itertools
+import operator
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import Dict, Any, Optional, List, Iterator
+from urllib.parse import quote
 
 try:
     from config import Config
@@ -14,257 +24,456 @@ except Exception:
     class Config:  # fallback
         DATABASE_PATH = 'pbx_system.db'
         DEFAULT_SUBSCRIPTION_MONTHS = 12
+        DB_POOL_SIZE = os.cpu_count() or 4
+        DB_OPTIMIZE_INTERVAL = 3 * 3600
+        CUSTOMER_CACHE_SIZE = 1024
+        CUSTOMER_CACHE_TTL = 60
+
+try:
+    import orjson
+
+    def _json_dumps(obj: Any) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+    _json_loads = orjson.loads
+except ImportError:  # stdlib fallback
+    def _json_dumps(obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False)
+
+    _json_loads = json.loads
 
 logger = logging.getLogger(__name__)
 
+# applied to every connection as it is opened; journal_mode=WAL is persistent
+# in the database file, so it is only (re-)issued on the read-write connection
+_CONNECTION_PRAGMAS = (
+    'PRAGMA busy_timeout=5000',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA cache_size=-65536',
+    # foreign_keys stays at SQLite's default (off): menu callbacks may write
+    # receipts/messages for a call_id that /pbx never logged (or '')
+)
+
+# json_patch() is built in from SQLite 3.38 (JSON1 compiled in by default)
+_HAS_JSON_PATCH = sqlite3.sqlite_version_info >= (3, 38, 0)
+
+# insert statements shared by the single-row and *_bulk writers
+_INSERT_CALL_SQL = '''
+    INSERT OR REPLACE INTO calls
+    (call_id, phone_number, customer_id, pbx_num, pbx_did, call_type, call_status, extension_id, extension_path, call_data, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+'''
+_INSERT_RECEIPT_SQL = '''
+    INSERT INTO receipts (customer_id, call_id, receipt_data, amount, description)
+    VALUES (?, ?, ?, ?, ?)
+'''
+_INSERT_MESSAGE_SQL = '''
+    INSERT INTO messages (customer_id, call_id, message_file, message_text, message_duration)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
+
+def _add_months(d: date, months: int) -> date:
+    """הוספת חודשים קלנדריים לתאריך (נצמד לסוף החודש כשצריך)"""
+    month_index = d.month - 1 + months
+    year, month = d.year + month_index // 12, month_index % 12 + 1
+    return d.replace(year=year, month=month, day=min(d.day, calendar.monthrange(year, month)[1]))
+
 
 class DatabaseHandler:
     """מחלקה לטיפול במאגר הנתונים, כולל מיגרציות עדינות, אנשי קשר וייצוא CSV"""
 
-    def __init__(self, db_path: str = None):
+    # columns callers may set through the update_* helpers
+    _CUSTOMER_FIELDS = frozenset({
+        'name','email','subscription_start_date','subscription_end_date','is_active',
+        'business_name','tz_id','owner_age','gender'
+    })
+    _DETAILS_FIELDS = frozenset({
+        'num_children','children_birth_years','spouse1_workplaces','spouse2_workplaces','additional_info'
+    })
+    _RECEIPT_FIELDS = frozenset({
+        'icount_doc_id', 'icount_doc_num', 'icount_response',
+        'amount', 'description', 'status', 'client_contact_id'
+    })
+
+    def __init__(self, db_path: str = None, pool_size: int = None):
         self.db_path = db_path or Config.DATABASE_PATH
+        # long-lived connections, reused so SQLite's page cache stays warm:
+        # a pool of read-only readers (WAL lets them run in parallel) and a
+        # single writer, since SQLite only ever admits one writer anyway
+        if pool_size is None:
+            pool_size = getattr(Config, 'DB_POOL_SIZE', None) or os.cpu_count() or 4
+        self._read_pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=int(pool_size))
+        self._writer: Optional[sqlite3.Connection] = None
+        self._write_lock = threading.Lock()
+        self._optimize_timer: Optional[threading.Timer] = None
+        # phone -> (expires_at, customer row or None for unknown numbers), LRU
+        # ordered; the TTL bounds staleness from writes made by other processes
+        self._cust_cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._cust_cache_size = int(getattr(Config, 'CUSTOMER_CACHE_SIZE', 1024))
+        self._cust_cache_ttl = float(getattr(Config, 'CUSTOMER_CACHE_TTL', 60))
+        self._cust_cache_lock = threading.Lock()
+        # bumped by every invalidation; a read that raced one is not cached
+        self._cust_cache_gen = 0
+        # (table, sorted column tuple) -> generated SQL
+        self._sql_cache: Dict[tuple, str] = {}
         self.init_database()
+        self._schedule_optimize()
 
     # ---------- connection ----------
-    def get_connection(self):
-        conn = sqlite3.connect(self.db_path)
+    def get_connection(self, readonly: bool = False):
+        # autocommit mode: multi-statement writes open their own transaction
+        if readonly:
+            target, uri = f"file:{quote(os.path.abspath(self.db_path))}?mode=ro", True
+        else:
+            target, uri = self.db_path, False
+        conn = sqlite3.connect(target, uri=uri, check_same_thread=False, isolation_level=None,
+                               cached_statements=256)
         conn.row_factory = sqlite3.Row
+        if not readonly:
+            conn.execute('PRAGMA journal_mode=WAL')
+        for pragma in _CONNECTION_PRAGMAS:
+            conn.execute(pragma)
         return conn
 
+    @contextmanager
+    def _read_conn(self):
+        """השאלת חיבור קריאה מהמאגר והחזרתו בסיום"""
+        try:
+            conn = self._read_pool.get_nowait()
+        except queue.Empty:
+            conn = self.get_connection(readonly=True)
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self._read_pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    @contextmanager
+    def _write_conn(self):
+        """גישה בלעדית לחיבור הכתיבה. טרנזקציות מרובות פקודות נפתחות ב-BEGIN IMMEDIATE."""
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self.get_connection()
+            conn = self._writer
+            try:
+                yield conn
+            except BaseException:
+                if conn.in_transaction:
+                    conn.rollback()
+                raise
+
+    def _insert_bulk(self, sql: str, rows: List[tuple]) -> int:
+        if not rows:
+            return 0
+        with self._write_conn() as conn:
+            cur = conn.cursor()
+            cur.execute('BEGIN IMMEDIATE')
+            cur.executemany(sql, rows)
+            cur.execute('COMMIT')
+        return len(rows)
+
+    def _update_sql(self, table: str, keys: tuple) -> str:
+        sql = self._sql_cache.get((table, keys))
+        if sql is None:
+            sets = ', '.join(f"{k} = ?" for k in keys + ('updated_at',))
+            sql = self._sql_cache[(table, keys)] = f"UPDATE {table} SET {sets} WHERE id = ?"
+        return sql
+
+    def _upsert_details_sql(self, keys: tuple) -> str:
+        sql = self._sql_cache.get(('customer_details', keys))
+        if sql is None:
+            columns = ('customer_id',) + keys + ('updated_at',)
+            updates = ', '.join(f"{k} = excluded.{k}" for k in keys + ('updated_at',))
+            sql = self._sql_cache[('customer_details', keys)] = (
+                f"INSERT INTO customer_details ({', '.join(columns)}) "
+                f"VALUES ({', '.join(['?'] * len(columns))}) "
+                f"ON CONFLICT(customer_id) DO UPDATE SET {updates}"
+            )
+        return sql
+
     # ---------- migrations helpers ----------
-    def _column_exists(self, conn: sqlite3.Connection, table: str, column: str) -> bool:
-        cur = conn.cursor()
-        cur.execute(f"PRAGMA table_info({table})")
-        cols = [r[1] for r in cur.fetchall()]
-        return column in cols
-
-    def _ensure_column(self, conn: sqlite3.Connection, table: str, column: str, coldef: str):
-        if not self._column_exists(conn, table, column):
+    def _get_columns(self, conn: sqlite3.Connection, table: str) -> frozenset:
+        return frozenset(r[1] for r in conn.execute(f"PRAGMA table_info({table})"))
+
+    def _ensure_column(self, conn: sqlite3.Connection, table: str, column: str, coldef: str,
+                       existing: frozenset = None):
+        if existing is None:
+            existing = self._get_columns(conn, table)
+        if column not in existing:
             conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {coldef}")
 
     # ---------- init & schema ----------
     def init_database(self):
-        conn = self.get_connection()
-        cur = conn.cursor()
-
-        # customers
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS customers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                phone_number TEXT UNIQUE NOT NULL,
-                name TEXT,
-                email TEXT,
-                business_name TEXT,
-                tz_id TEXT,
-                owner_age INTEGER,
-                gender TEXT,
-                subscription_start_date DATE,
-                subscription_end_date DATE,
-                is_active BOOLEAN DEFAULT 1,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        # details
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS customer_details (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                customer_id INTEGER UNIQUE,
-                num_children INTEGER,
-                children_birth_years TEXT,
-                spouse1_workplaces INTEGER,
-                spouse2_workplaces INTEGER,
-                additional_info TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (customer_id) REFERENCES customers (id) ON DELETE CASCADE
-            )
-        ''')
-
-        # calls
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS calls (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                call_id TEXT UNIQUE NOT NULL,
-                phone_number TEXT,
-                customer_id INTEGER,
-                pbx_num TEXT,
-                pbx_did TEXT,
-                call_type TEXT,
-                call_status TEXT,
-                extension_id TEXT,
-                extension_path TEXT,
-                call_data TEXT,
-                started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                ended_at DATETIME,
-                duration INTEGER,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (customer_id) REFERENCES customers (id)
-            )
-        ''')
-
-        # receipts
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS receipts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                customer_id INTEGER NOT NULL,
-                call_id TEXT,
-                receipt_data TEXT NOT NULL,
-                icount_doc_id TEXT,
-                icount_doc_num TEXT,
-                icount_response TEXT,
-                amount DECIMAL(10,2),
-                description TEXT,
-                status TEXT DEFAULT 'pending',
-                client_contact_id INTEGER,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (customer_id) REFERENCES customers (id),
-                FOREIGN KEY (call_id) REFERENCES calls (call_id)
-            )
-        ''')
-
-        # messages
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                customer_id INTEGER NOT NULL,
-                call_id TEXT,
-                message_file TEXT,
-                message_text TEXT,
-                message_duration INTEGER,
-                status TEXT DEFAULT 'new',
-                priority TEXT DEFAULT 'normal',
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                processed_at DATETIME,
-                FOREIGN KEY (customer_id) REFERENCES customers (id),
-                FOREIGN KEY (call_id) REFERENCES calls (call_id)
-            )
-        ''')
-
-        # annual reports
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS annual_reports (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                customer_id INTEGER NOT NULL,
-                report_year INTEGER,
-                report_data TEXT,
-                report_file TEXT,
-                status TEXT DEFAULT 'requested',
-                requested_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                generated_at DATETIME,
-                sent_at DATETIME,
-                UNIQUE(customer_id, report_year),
-                FOREIGN KEY (customer_id) REFERENCES customers (id)
-            )
-        ''')
-
-        # contacts (address book for receipt targets)
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS contacts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                customer_id INTEGER NOT NULL,
-                name TEXT,
-                phone TEXT,
-                email TEXT,
-                tz_id TEXT,
-                business_name TEXT,
-                notes TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(customer_id, phone),
-                FOREIGN KEY (customer_id) REFERENCES customers (id) ON DELETE CASCADE
-            )
-        ''')
-
-        # indices
-        cur.execute('CREATE INDEX IF NOT EXISTS idx_customers_phone ON customers (phone_number)')
-        cur.execute('CREATE INDEX IF NOT EXISTS idx_calls_call_id ON calls (call_id)')
-        cur.execute('CREATE INDEX IF NOT EXISTS idx_calls_phone ON calls (phone_number)')
-        cur.execute('CREATE INDEX IF NOT EXISTS idx_receipts_customer ON receipts (customer_id)')
-        cur.execute('CREATE INDEX IF NOT EXISTS idx_messages_customer ON messages (customer_id)')
-        cur.execute('CREATE INDEX IF NOT EXISTS idx_reports_customer ON annual_reports (customer_id)')
-        cur.execute('CREATE INDEX IF NOT EXISTS idx_contacts_customer ON contacts (customer_id)')
-
-        # gentle migrations for existing DBs that predate new columns
-        try:
-            self._ensure_column(conn, 'customers', 'business_name', 'TEXT')
-            self._ensure_column(conn, 'customers', 'tz_id', 'TEXT')
-            self._ensure_column(conn, 'customers', 'owner_age', 'INTEGER')
-            self._ensure_column(conn, 'customers', 'gender', 'TEXT')
-            self._ensure_column(conn, 'receipts', 'client_contact_id', 'INTEGER')
-            self._ensure_column(conn, 'calls', 'updated_at', 'DATETIME DEFAULT CURRENT_TIMESTAMP')
-        except Exception as e:
-            logger.warning(f"migrations: {e}")
+        with self._write_conn() as conn:
+            cur = conn.cursor()
+            # all DDL + migrations in one transaction -> one journal flush
+            cur.execute('BEGIN IMMEDIATE')
+
+            # customers
+            cur.execute('''
+                CREATE TABLE IF NOT EXISTS customers (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    phone_number TEXT UNIQUE NOT NULL,
+                    name TEXT,
+                    email TEXT,
+                    business_name TEXT,
+                    tz_id TEXT,
+                    owner_age INTEGER,
+                    gender TEXT,
+                    subscription_start_date DATE,
+                    subscription_end_date DATE,
+                    is_active BOOLEAN DEFAULT 1,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # details
+            cur.execute('''
+                CREATE TABLE IF NOT EXISTS customer_details (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    customer_id INTEGER UNIQUE,
+                    num_children INTEGER,
+                    children_birth_years TEXT,
+                    spouse1_workplaces INTEGER,
+                    spouse2_workplaces INTEGER,
+                    additional_info TEXT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (customer_id) REFERENCES customers (id) ON DELETE CASCADE
+                )
+            ''')
+
+            # calls
+            cur.execute('''
+                CREATE TABLE IF NOT EXISTS calls (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    call_id TEXT UNIQUE NOT NULL,
+                    phone_number TEXT,
+                    customer_id INTEGER,
+                    pbx_num TEXT,
+                    pbx_did TEXT,
+                    call_type TEXT,
+                    call_status TEXT,
+                    extension_id TEXT,
+                    extension_path TEXT,
+                    call_data TEXT,
+                    started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    ended_at DATETIME,
+                    duration INTEGER,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (customer_id) REFERENCES customers (id)
+                )
+            ''')
+
+            # receipts
+            cur.execute('''
+                CREATE TABLE IF NOT EXISTS receipts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    customer_id INTEGER NOT NULL,
+                    call_id TEXT,
+                    receipt_data TEXT NOT NULL,
+                    icount_doc_id TEXT,
+                    icount_doc_num TEXT,
+                    icount_response TEXT,
+                    amount DECIMAL(10,2),
+                    description TEXT,
+                    status TEXT DEFAULT 'pending',
+                    client_contact_id INTEGER,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (customer_id) REFERENCES customers (id),
+                    FOREIGN KEY (call_id) REFERENCES calls (call_id)
+                )
+            ''')
+
+            # messages
+            cur.execute('''
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    customer_id INTEGER NOT NULL,
+                    call_id TEXT,
+                    message_file TEXT,
+                    message_text TEXT,
+                    message_duration INTEGER,
+                    status TEXT DEFAULT 'new',
+                    priority TEXT DEFAULT 'normal',
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    processed_at DATETIME,
+                    FOREIGN KEY (customer_id) REFERENCES customers (id),
+                    FOREIGN KEY (call_id) REFERENCES calls (call_id)
+                )
+            ''')
+
+            # annual reports
+            cur.execute('''
+                CREATE TABLE IF NOT EXISTS annual_reports (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    customer_id INTEGER NOT NULL,
+                    report_year INTEGER,
+                    report_data TEXT,
+                    report_file TEXT,
+                    status TEXT DEFAULT 'requested',
+                    requested_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    generated_at DATETIME,
+                    sent_at DATETIME,
+                    UNIQUE(customer_id, report_year),
+                    FOREIGN KEY (customer_id) REFERENCES customers (id)
+                )
+            ''')
+
+            # contacts (address book for receipt targets)
+            cur.execute('''
+                CREATE TABLE IF NOT EXISTS contacts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    customer_id INTEGER NOT NULL,
+                    name TEXT,
+                    phone TEXT,
+                    email TEXT,
+                    tz_id TEXT,
+                    business_name TEXT,
+                    notes TEXT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE(customer_id, phone),
+                    FOREIGN KEY (customer_id) REFERENCES customers (id) ON DELETE CASCADE
+                )
+            ''')
+
+            # indices
+            index_count = "SELECT COUNT(*) FROM sqlite_master WHERE type = 'index'"
+            indexes_before = cur.execute(index_count).fetchone()[0]
+            cur.execute('CREATE INDEX IF NOT EXISTS idx_customers_phone ON customers (phone_number)')
+            cur.execute('CREATE INDEX IF NOT EXISTS idx_calls_call_id ON calls (call_id)')
+            cur.execute('CREATE INDEX IF NOT EXISTS idx_calls_phone ON calls (phone_number)')
+            cur.execute('CREATE INDEX IF NOT EXISTS idx_receipts_customer ON receipts (customer_id)')
+            cur.execute('CREATE INDEX IF NOT EXISTS idx_messages_customer ON messages (customer_id)')
+            cur.execute('CREATE INDEX IF NOT EXISTS idx_reports_customer ON annual_reports (customer_id)')
+            cur.execute('CREATE INDEX IF NOT EXISTS idx_contacts_customer ON contacts (customer_id)')
+            # composite indices matching the hot lookup + ORDER BY patterns
+            cur.execute('CREATE INDEX IF NOT EXISTS idx_contacts_customer_updated ON contacts (customer_id, updated_at DESC)')
+            cur.execute('CREATE INDEX IF NOT EXISTS idx_contacts_customer_phone ON contacts (customer_id, phone)')
+            cur.execute('CREATE INDEX IF NOT EXISTS idx_receipts_customer_created ON receipts (customer_id, created_at DESC)')
+            cur.execute('CREATE INDEX IF NOT EXISTS idx_calls_customer_started ON calls (customer_id, started_at DESC)')
+            cur.execute('CREATE INDEX IF NOT EXISTS idx_messages_customer_created ON messages (customer_id, created_at DESC)')
+            if cur.execute(index_count).fetchone()[0] != indexes_before:
+                cur.execute('ANALYZE')
+
+            # gentle migrations for existing DBs that predate new columns
+            try:
+                customers_cols = self._get_columns(conn, 'customers')
+                receipts_cols = self._get_columns(conn, 'receipts')
+                calls_cols = self._get_columns(conn, 'calls')
+                self._ensure_column(conn, 'customers', 'business_name', 'TEXT', customers_cols)
+                self._ensure_column(conn, 'customers', 'tz_id', 'TEXT', customers_cols)
+                self._ensure_column(conn, 'customers', 'owner_age', 'INTEGER', customers_cols)
+                self._ensure_column(conn, 'customers', 'gender', 'TEXT', customers_cols)
+                self._ensure_column(conn, 'receipts', 'client_contact_id', 'INTEGER', receipts_cols)
+                self._ensure_column(conn, 'calls', 'updated_at', 'DATETIME DEFAULT CURRENT_TIMESTAMP', calls_cols)
+            except Exception as e:
+                logger.warning("migrations: %s", e)
+
+            cur.execute('COMMIT')
+            conn.execute('PRAGMA optimize')
 
-        conn.commit()
-        conn.close()
         logger.info("מאגר הנתונים אותחל/שודרג בהצלחה")
 
     # ---------- customers ----------
-    def get_customer_by_phone(self, phone_number: str) -> Optional[Dict]:
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM customers WHERE phone_number = ?', (phone_number,))
-        row = cur.fetchone()
-        conn.close()
-        return dict(row) if row else None
+    def get_customer_by_phone(self, phone_number: str, cache: bool = True) -> Optional[Dict]:
+        if cache:
+            with self._cust_cache_lock:
+                entry = self._cust_cache.get(phone_number)
+                if entry is not None:
+                    expires_at, cust = entry
+                    if expires_at > time.monotonic():
+                        self._cust_cache.move_to_end(phone_number)
+                        return dict(cust) if cust else None
+                    del self._cust_cache[phone_number]
+                gen = self._cust_cache_gen
+        with self._read_conn() as conn:
+            row = conn.execute('SELECT * FROM customers WHERE phone_number = ?', (phone_number,)).fetchone()
+        cust = dict(row) if row else None
+        if cache and self._cust_cache_size > 0:
+            with self._cust_cache_lock:
+                if gen != self._cust_cache_gen:
+                    # a write invalidated the cache while we were reading; the row may be stale
+                    return dict(cust) if cust else None
+                self._cust_cache[phone_number] = (time.monotonic() + self._cust_cache_ttl, cust)
+                self._cust_cache.move_to_end(phone_number)
+                if len(self._cust_cache) > self._cust_cache_size:
+                    self._cust_cache.popitem(last=False)
+        return dict(cust) if cust else None
+
+    def _invalidate_customer(self, phone_number: str = None, customer_id: int = None):
+        with self._cust_cache_lock:
+            self._cust_cache_gen += 1
+            if phone_number is not None:
+                self._cust_cache.pop(phone_number, None)
+            if customer_id is not None:
+                for phone, (_, cust) in list(self._cust_cache.items()):
+                    if cust and cust['id'] == customer_id:
+                        del self._cust_cache[phone]
 
     def get_customer_by_id(self, customer_id: int) -> Optional[Dict]:
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM customers WHERE id = ?', (customer_id,))
-        row = cur.fetchone()
-        conn.close()
+        with self._read_conn() as conn:
+            row = conn.execute('SELECT * FROM customers WHERE id = ?', (customer_id,)).fetchone()
         return dict(row) if row else None
 
     def create_customer(self, phone_number: str, name: str = None, email: str = None) -> int:
-        conn = self.get_connection()
-        cur = conn.cursor()
         start_date = datetime.now().date()
         months = int(getattr(Config, 'DEFAULT_SUBSCRIPTION_MONTHS', 12))
-        end_date = start_date + timedelta(days=30*months)
-        cur.execute('''
-            INSERT INTO customers (phone_number, name, email, subscription_start_date, subscription_end_date)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (phone_number, name, email, start_date, end_date))
-        customer_id = cur.lastrowid
-        # create empty details row
-        cur.execute('INSERT INTO customer_details (customer_id) VALUES (?)', (customer_id,))
-        conn.commit()
-        conn.close()
-        logger.info(f"נוצר לקוח חדש: {phone_number} (ID: {customer_id})")
+        end_date = _add_months(start_date, months)
+        with self._write_conn() as conn:
+            cur = conn.cursor()
+            cur.execute('BEGIN IMMEDIATE')
+            cur.execute('''
+                INSERT INTO customers (phone_number, name, email, subscription_start_date, subscription_end_date)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(phone_number) DO NOTHING
+                RETURNING id
+            ''', (phone_number, name, email, start_date.isoformat(), end_date.isoformat()))
+            row = cur.fetchone()
+            if row:
+                customer_id = row['id']
+                # create empty details row
+                cur.execute('INSERT INTO customer_details (customer_id) VALUES (?)', (customer_id,))
+            else:
+                # another request registered this number first
+                customer_id = cur.execute(
+                    'SELECT id FROM customers WHERE phone_number = ?', (phone_number,)
+                ).fetchone()['id']
+            cur.execute('COMMIT')
+        self._invalidate_customer(phone_number=phone_number)
+        if row:
+            logger.info("נוצר לקוח חדש: %s (ID: %s)", phone_number, customer_id)
         return customer_id
 
     def update_customer(self, customer_id: int, **kwargs) -> bool:
-        if not kwargs:
-            return False
-        allowed = {
-            'name','email','subscription_start_date','subscription_end_date','is_active',
-            'business_name','tz_id','owner_age','gender'
-        }
-        set_clauses, values = [], []
-        for k, v in kwargs.items():
-            if k in allowed:
-                set_clauses.append(f"{k} = ?")
-                values.append(v)
-        if not set_clauses:
+        # sorted so the same set of fields always yields the same SQL text
+        keys = tuple(sorted(self._CUSTOMER_FIELDS.intersection(kwargs)))
+        if not keys:
             return False
-        set_clauses.append("updated_at = ?")
-        values.append(datetime.now())
-        values.append(customer_id)
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute(f"UPDATE customers SET {', '.join(set_clauses)} WHERE id = ?", values)
-        ok = cur.rowcount > 0
-        conn.commit()
-        conn.close()
+        sql = self._update_sql('customers', keys)
+        with self._write_conn() as conn:
+            cur = conn.execute(sql, (*(kwargs[k] for k in keys), datetime.now(), customer_id))
+            ok = cur.rowcount > 0
+        self._invalidate_customer(customer_id=customer_id)
         return ok
 
     def is_subscription_active(self, customer: Dict) -> bool:
         if not customer or not customer.get('subscription_end_date'):
             return False
+        end = customer['subscription_end_date']
+        if isinstance(end, str) and len(end) >= 10 and end[4] == '-' and end[7] == '-':
+            # ISO-8601 strings compare correctly as plain strings
+            return end >= date.today().isoformat()
         try:
             end_date = datetime.strptime(str(customer['subscription_end_date']), '%Y-%m-%d').date()
         except Exception:
@@ -274,6 +483,14 @@ class DatabaseHandler:
                 return False
         return end_date >= datetime.now().date()
 
+    def is_subscription_active_by_id(self, customer_id: int) -> bool:
+        with self._read_conn() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM customers WHERE id = ? AND subscription_end_date >= date('now', 'localtime')",
+                (customer_id,)
+            ).fetchone()
+        return row is not None
+
     # profile helpers
     def is_profile_complete(self, customer: Dict) -> bool:
         if not customer:
@@ -294,61 +511,35 @@ class DatabaseHandler:
 
     # ---------- details ----------
     def get_customer_details(self, customer_id: int) -> Optional[Dict]:
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM customer_details WHERE customer_id = ?', (customer_id,))
-        row = cur.fetchone()
-        conn.close()
+        with self._read_conn() as conn:
+            row = conn.execute('SELECT * FROM customer_details WHERE customer_id = ?', (customer_id,)).fetchone()
         return dict(row) if row else None
 
     def update_customer_details(self, customer_id: int, **kwargs) -> bool:
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute('SELECT id FROM customer_details WHERE customer_id = ?', (customer_id,))
-        exists = cur.fetchone()
-        allowed = {'num_children','children_birth_years','spouse1_workplaces','spouse2_workplaces','additional_info'}
-        if exists:
-            set_clauses, values = [], []
-            for k, v in kwargs.items():
-                if k in allowed:
-                    set_clauses.append(f"{k} = ?")
-                    values.append(v)
-            if set_clauses:
-                set_clauses.append("updated_at = ?")
-                values.append(datetime.now())
-                values.append(customer_id)
-                cur.execute(f"UPDATE customer_details SET {', '.join(set_clauses)} WHERE customer_id = ?", values)
-                ok = cur.rowcount > 0
-            else:
-                ok = False
-        else:
-            columns = ['customer_id']
-            values = [customer_id]
-            for k, v in kwargs.items():
-                if k in allowed:
-                    columns.append(k)
-                    values.append(v)
-            placeholders = ', '.join(['?'] * len(values))
-            cur.execute(f"INSERT INTO customer_details ({', '.join(columns)}) VALUES ({placeholders})", values)
-            ok = cur.rowcount > 0
-        conn.commit()
-        conn.close()
-        return ok
+        """עדכון/יצירת פרטים אישיים בפקודת UPSERT אחת - כל השדות נכתבים יחד בטרנזקציה אחת."""
+        keys = tuple(sorted(self._DETAILS_FIELDS.intersection(kwargs)))
+        with self._write_conn() as conn:
+            if not keys:
+                # make sure the row exists, but report no update
+                cur = conn.execute(
+                    'INSERT INTO customer_details (customer_id) VALUES (?) ON CONFLICT(customer_id) DO NOTHING',
+                    (customer_id,)
+                )
+                return cur.rowcount > 0
+            cur = conn.execute(
+                self._upsert_details_sql(keys),
+                (customer_id, *(kwargs[k] for k in keys), datetime.now())
+            )
+            return cur.rowcount > 0
 
     # ---------- calls ----------
-    def log_call(self, call_params: Dict) -> int:
-        conn = self.get_connection()
-        cur = conn.cursor()
+    def _call_row(self, call_params: Dict) -> tuple:
         customer_id = None
         if call_params.get('PBXphone'):
             cust = self.get_customer_by_phone(call_params['PBXphone'])
             if cust:
                 customer_id = cust['id']
-        cur.execute('''
-            INSERT OR REPLACE INTO calls 
-            (call_id, phone_number, customer_id, pbx_num, pbx_did, call_type, call_status, extension_id, extension_path, call_data, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-        ''', (
+        return (
             call_params.get('PBXcallId'),
             call_params.get('PBXphone'),
             customer_id,
@@ -358,208 +549,236 @@ class DatabaseHandler:
             call_params.get('PBXcallStatus'),
             call_params.get('PBXextensionId'),
             call_params.get('PBXextensionPath'),
-            json.dumps(call_params, ensure_ascii=False)
-        ))
-        row_id = cur.lastrowid
-        conn.commit()
-        conn.close()
-        return row_id
+            _json_dumps(call_params)
+        )
+
+    def log_call(self, call_params: Dict) -> int:
+        row = self._call_row(call_params)
+        with self._write_conn() as conn:
+            return conn.execute(_INSERT_CALL_SQL, row).lastrowid
+
+    def log_calls_bulk(self, calls: List[Dict]) -> int:
+        """רישום שיחות רבות בטרנזקציה אחת. מחזיר מספר שורות שנכתבו."""
+        return self._insert_bulk(_INSERT_CALL_SQL, [self._call_row(p) for p in calls])
 
     def update_call_data(self, call_id: str, new_data: Dict) -> bool:
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute('SELECT call_data FROM calls WHERE call_id = ?', (call_id,))
-        row = cur.fetchone()
-        if row:
-            existing = json.loads(row['call_data'] or '{}')
-            existing.update(new_data)
-            cur.execute(
-                'UPDATE calls SET call_data = ?, updated_at = CURRENT_TIMESTAMP WHERE call_id = ?',
-                (json.dumps(existing, ensure_ascii=False), call_id)
-            )
-            ok = cur.rowcount > 0
-        else:
-            ok = False
-        conn.commit()
-        conn.close()
+        # merge inside SQLite unless the RFC 7396 patch rules would differ from
+        # dict.update (null deletes a key, nested objects merge recursively)
+        if _HAS_JSON_PATCH and not any(v is None or isinstance(v, dict) for v in new_data.values()):
+            with self._write_conn() as conn:
+                cur = conn.execute(
+                    "UPDATE calls SET call_data = json_patch(COALESCE(call_data, '{}'), ?), "
+                    "updated_at = CURRENT_TIMESTAMP WHERE call_id = ?",
+                    (_json_dumps(new_data), call_id)
+                )
+                return cur.rowcount > 0
+        with self._write_conn() as conn:
+            cur = conn.cursor()
+            cur.execute('BEGIN IMMEDIATE')
+            cur.execute('SELECT call_data FROM calls WHERE call_id = ?', (call_id,))
+            row = cur.fetchone()
+            if row:
+                existing = _json_loads(row['call_data'] or '{}')
+                existing.update(new_data)
+                cur.execute(
+                    'UPDATE calls SET call_data = ?, updated_at = CURRENT_TIMESTAMP WHERE call_id = ?',
+                    (_json_dumps(existing), call_id)
+                )
+                ok = cur.rowcount > 0
+            else:
+                ok = False
+            cur.execute('COMMIT')
         return ok
 
     # ---------- receipts ----------
-    def create_receipt(self, customer_id: int, call_id: str, receipt_data: Dict) -> int:
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute('''
-            INSERT INTO receipts (customer_id, call_id, receipt_data, amount, description)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (
+    @staticmethod
+    def _receipt_row(customer_id: int, call_id: str, receipt_data: Dict) -> tuple:
+        return (
             customer_id,
             call_id,
-            json.dumps(receipt_data, ensure_ascii=False),
+            _json_dumps(receipt_data),
             receipt_data.get('amount', 0),
             receipt_data.get('description', '')
-        ))
-        rid = cur.lastrowid
-        conn.commit()
-        conn.close()
-        return rid
+        )
+
+    def create_receipt(self, customer_id: int, call_id: str, receipt_data: Dict) -> int:
+        row = self._receipt_row(customer_id, call_id, receipt_data)
+        with self._write_conn() as conn:
+            return conn.execute(_INSERT_RECEIPT_SQL, row).lastrowid
+
+    def create_receipts_bulk(self, receipts: List[Dict]) -> int:
+        """יצירת קבלות רבות בטרנזקציה אחת.
+        כל פריט: {'customer_id', 'call_id', 'receipt_data'}. מחזיר מספר שורות שנכתבו."""
+        return self._insert_bulk(_INSERT_RECEIPT_SQL, [
+            self._receipt_row(r['customer_id'], r.get('call_id'), r['receipt_data']) for r in receipts
+        ])
 
     def update_receipt(self, receipt_id: int, **kwargs) -> bool:
-        if not kwargs:
-            return False
-        allowed = {
-            'icount_doc_id', 'icount_doc_num', 'icount_response',
-            'amount', 'description', 'status', 'client_contact_id'
-        }
-        set_clauses, values = [], []
-        for k, v in kwargs.items():
-            if k in allowed:
-                set_clauses.append(f"{k} = ?")
-                values.append(v)
-        if not set_clauses:
+        keys = tuple(sorted(self._RECEIPT_FIELDS.intersection(kwargs)))
+        if not keys:
             return False
-        set_clauses.append("updated_at = ?")
-        values.append(datetime.now())
-        values.append(receipt_id)
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute(f"UPDATE receipts SET {', '.join(set_clauses)} WHERE id = ?", values)
-        ok = cur.rowcount > 0
-        conn.commit()
-        conn.close()
-        return ok
+        sql = self._update_sql('receipts', keys)
+        with self._write_conn() as conn:
+            cur = conn.execute(sql, (*(kwargs[k] for k in keys), datetime.now(), receipt_id))
+            return cur.rowcount > 0
 
     # ---------- messages ----------
     def save_message(self, customer_id: int, call_id: str,
                      message_file: str = None, message_text: str = None,
                      duration: int = None) -> int:
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute('''
-            INSERT INTO messages (customer_id, call_id, message_file, message_text, message_duration)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (customer_id, call_id, message_file, message_text, duration))
-        mid = cur.lastrowid
-        conn.commit()
-        conn.close()
-        logger.info(f"נשמרה הודעה חדשה: ID {mid}")
+        with self._write_conn() as conn:
+            cur = conn.execute(_INSERT_MESSAGE_SQL, (customer_id, call_id, message_file, message_text, duration))
+            mid = cur.lastrowid
+        logger.info("נשמרה הודעה חדשה: ID %s", mid)
         return mid
 
+    def save_messages_bulk(self, messages: List[Dict]) -> int:
+        """שמירת הודעות רבות בטרנזקציה אחת.
+        כל פריט: {'customer_id', 'call_id', 'message_file', 'message_text', 'duration'}. מחזיר מספר שורות שנכתבו."""
+        count = self._insert_bulk(_INSERT_MESSAGE_SQL, [
+            (m['customer_id'], m.get('call_id'), m.get('message_file'), m.get('message_text'), m.get('duration'))
+            for m in messages
+        ])
+        logger.info("נשמרו %s הודעות", count)
+        return count
+
     # ---------- annual reports ----------
     def request_annual_report(self, customer_id: int, report_year: int = None) -> int:
         if not report_year:
             report_year = datetime.now().year - 1
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute('''
-            INSERT OR REPLACE INTO annual_reports (customer_id, report_year, status, requested_at)
-            VALUES (?, ?, 'requested', ?)
-        ''', (customer_id, report_year, datetime.now()))
-        rid = cur.lastrowid
-        conn.commit()
-        conn.close()
-        logger.info(f"נתבקש דיווח שנתי: לקוח {customer_id}, שנה {report_year}")
+        with self._write_conn() as conn:
+            # re-requesting keeps the existing row (and its report_file)
+            rid = conn.execute('''
+                INSERT INTO annual_reports (customer_id, report_year, status, requested_at)
+                VALUES (?, ?, 'requested', ?)
+                ON CONFLICT(customer_id, report_year) DO UPDATE
+                   SET status = 'requested', requested_at = excluded.requested_at
+                RETURNING id
+            ''', (customer_id, report_year, datetime.now())).fetchone()['id']
+        logger.info("נתבקש דיווח שנתי: לקוח %s, שנה %s", customer_id, report_year)
         return rid
 
     # ---------- contacts (address book) ----------
     def upsert_contact(self, customer_id: int, phone: str, name: str = None, tz_id: str = None,
                        business_name: str = None, email: str = None, notes: str = None) -> int:
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute('SELECT id FROM contacts WHERE customer_id=? AND phone=?', (customer_id, phone))
-        row = cur.fetchone()
-        if row:
-            cur.execute('''
-                UPDATE contacts
-                   SET name = COALESCE(?, name),
-                       tz_id = COALESCE(?, tz_id),
-                       business_name = COALESCE(?, business_name),
-                       email = COALESCE(?, email),
-                       notes = COALESCE(?, notes),
-                       updated_at = CURRENT_TIMESTAMP
-                 WHERE id = ?
-            ''', (name, tz_id, business_name, email, notes, row['id']))
-            cid = row['id']
-        else:
-            cur.execute('''
+        with self._write_conn() as conn:
+            row = conn.execute('''
                 INSERT INTO contacts (customer_id, phone, name, tz_id, business_name, email, notes)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (customer_id, phone, name, tz_id, business_name, email, notes))
-            cid = cur.lastrowid
-        conn.commit()
-        conn.close()
-        return cid
+                ON CONFLICT(customer_id, phone) DO UPDATE
+                   SET name = COALESCE(excluded.name, contacts.name),
+                       tz_id = COALESCE(excluded.tz_id, contacts.tz_id),
+                       business_name = COALESCE(excluded.business_name, contacts.business_name),
+                       email = COALESCE(excluded.email, contacts.email),
+                       notes = COALESCE(excluded.notes, contacts.notes),
+                       updated_at = CURRENT_TIMESTAMP
+                RETURNING id
+            ''', (customer_id, phone, name, tz_id, business_name, email, notes)).fetchone()
+        return row['id']
 
     def get_contact_by_phone(self, customer_id: int, phone: str) -> Optional[Dict]:
-        conn = self.get_connection()
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM contacts WHERE customer_id=? AND phone=?', (customer_id, phone))
-        row = cur.fetchone()
-        conn.close()
+        with self._read_conn() as conn:
+            cur = conn.cursor()
+            cur.execute('SELECT * FROM contacts WHERE customer_id=? AND phone=?', (customer_id, phone))
+            row = cur.fetchone()
         return dict(row) if row else None
 
+    def iter_contacts(self, customer_id: int, limit: int = None) -> Iterator[Dict]:
+        """מעבר עצל על אנשי הקשר, מהעדכני ביותר. החיבור מוחזר למאגר בסיום המעבר."""
+        with self._read_conn() as conn:
+            cur = conn.execute(
+                'SELECT * FROM contacts WHERE customer_id=? ORDER BY updated_at DESC LIMIT ?',
+                (customer_id, -1 if limit is None else limit)
+            )
+            try:
+                for r in cur:
+                    yield dict(r)
+            finally:
+                cur.close()  # release the read snapshot if iteration stops early
+
     def list_contacts(self, customer_id: int, limit: int = 20) -> List[Dict]:
-        conn = self.get_connection()
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-        cur.execute(
-            'SELECT * FROM contacts WHERE customer_id=? ORDER BY updated_at DESC LIMIT ?',
-            (customer_id, limit)
-        )
-        rows = cur.fetchall()
-        conn.close()
-        return [dict(r) for r in rows]
+        return list(self.iter_contacts(customer_id, limit))
 
     # ---------- CSV export helpers ----------
+    def _write_cursor_csv(self, cur: sqlite3.Cursor, out_path: str) -> int:
+        """כתיבת תוצאות cursor לקובץ CSV תוך כדי מעבר על השורות. מחזיר מספר שורות."""
+        # rows are counted by zipping with itertools.count, so the per-row loop
+        # runs entirely in C (cursor -> zip -> itemgetter -> _csv writer).
+        # sqlite3.Row is a sequence; csv reads it positionally.
+        counter = itertools.count()
+        # large buffer so write() syscalls are batched while rows stream in
+        with open(out_path, 'w', newline='', encoding='utf-8', buffering=1024 * 1024) as f:
+            writer = csv.writer(f)
+            writer.writerow([d[0] for d in cur.description])
+            writer.writerows(map(operator.itemgetter(0), zip(cur, counter)))
+        # zip stops on the exhausted cursor before advancing the counter again
+        return next(counter)
+
     def export_table_to_csv(self, table: str, out_path: str) -> int:
         """ייצוא טבלה גולמית לקובץ CSV. מחזיר מספר שורות שנכתבו."""
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute(f'SELECT * FROM {table}')
-        rows = cur.fetchall()
-        col_names = [d[0] for d in cur.description]
-        with open(out_path, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(col_names)
-            for r in rows:
-                writer.writerow([r[c] for c in col_names])
-        conn.close()
-        return len(rows)
+        with self._read_conn() as conn:
+            cur = conn.execute(f'SELECT * FROM {table}')
+            return self._write_cursor_csv(cur, out_path)
 
     def export_receipts_with_phone_csv(self, out_path: str) -> int:
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute('''
-            SELECT r.*, c.phone_number AS issuer_phone
-            FROM receipts r
-            JOIN customers c ON c.id = r.customer_id
-            ORDER BY r.created_at DESC
-        ''')
-        rows = cur.fetchall()
-        col_names = [d[0] for d in cur.description]
-        with open(out_path, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(col_names)
-            for r in rows:
-                writer.writerow([r[c] for c in col_names])
-        conn.close()
-        return len(rows)
+        with self._read_conn() as conn:
+            cur = conn.execute('''
+                SELECT r.*, c.phone_number AS issuer_phone
+                FROM receipts r
+                JOIN customers c ON c.id = r.customer_id
+                ORDER BY r.created_at DESC
+            ''')
+            return self._write_cursor_csv(cur, out_path)
 
     def export_contacts_csv(self, customer_id: int, out_path: str) -> int:
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM contacts WHERE customer_id=? ORDER BY updated_at DESC', (customer_id,))
-        rows = cur.fetchall()
-        col_names = [d[0] for d in cur.description]
-        with open(out_path, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(col_names)
-            for r in rows:
-                writer.writerow([r[c] for c in col_names])
-        conn.close()
-        return len(rows)
+        with self._read_conn() as conn:
+            cur = conn.execute('SELECT * FROM contacts WHERE customer_id=? ORDER BY updated_at DESC', (customer_id,))
+            return self._write_cursor_csv(cur, out_path)
+
+    # ---------- planner statistics ----------
+    def optimize(self):
+        """עדכון סטטיסטיקות ה-planner עבור טבלאות שהשתנו"""
+        with self._write_conn() as conn:
+            conn.execute('PRAGMA optimize')
+
+    def rebuild_stats(self):
+        """בניית סטטיסטיקות מחדש לכל הטבלאות (פעולת ניהול, חסומה בזמן)"""
+        with self._write_conn() as conn:
+            conn.execute('PRAGMA optimize=0x10002')
+
+    def _schedule_optimize(self):
+        interval = float(getattr(Config, 'DB_OPTIMIZE_INTERVAL', 3 * 3600))
+        if interval <= 0:
+            return
+        self._optimize_timer = threading.Timer(interval, self._periodic_optimize)
+        self._optimize_timer.daemon = True
+        self._optimize_timer.start()
+
+    def _periodic_optimize(self):
+        try:
+            self.optimize()
+        except Exception as e:
+            logger.warning("optimize: %s", e)
+        if self._optimize_timer is not None:
+            self._schedule_optimize()
 
     # ---------- close ----------
     def close(self):
-        # nothing to close explicitly – connections are short-lived
-        pass
+        """הרצת PRAGMA optimize וסגירת כל החיבורים שבמאגר"""
+        timer, self._optimize_timer = self._optimize_timer, None
+        if timer is not None:
+            timer.cancel()
+        while True:
+            try:
+                conn = self._read_pool.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+        with self._write_lock:
+            conn, self._writer = self._writer, None
+            if conn is not None:
+                try:
+                    conn.execute('PRAGMA optimize')
+                except sqlite3.Error as e:
+                    logger.warning("optimize: %s", e)
+                conn.close()
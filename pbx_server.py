@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from flask import Flask, request, jsonify
-import json
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import DefaultJSONProvider
+import atexit
+import concurrent.futures
 import logging
 import os
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
 from typing import Dict, Any, Optional
 
@@ -17,10 +22,26 @@ except Exception:
         LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
         LOG_FILE = os.getenv('LOG_FILE', 'pbx_system.log')
         DATABASE_PATH = os.getenv('DATABASE_PATH', 'pbx_system.db')
+        DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', os.cpu_count() or 4))
         ICOUNT_MOCK = True
         MOCK_RECEIPTS_PREFIX = 'DBG'
+        CALL_STATE_TTL = 3600
+        CALL_STATE_FLUSH_INTERVAL = 5
 
-from database_handler import DatabaseHandler
+
+def _as_bool(value: Any) -> bool:
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+# settings read once at import
+_ICOUNT_MOCK = _as_bool(getattr(Config, 'ICOUNT_MOCK', 'true'))
+_DEBUG = _as_bool(getattr(Config, 'DEBUG', 'true'))
+_DB_PATH = getattr(Config, 'DATABASE_PATH', 'pbx_system.db')
+_MOCK_PREFIX = getattr(Config, 'MOCK_RECEIPTS_PREFIX', 'DBG')
+# a call's pending call_data is dropped after this many failed writes in a row
+_CALL_STATE_FLUSH_ATTEMPTS = 3
+
+from database_handler import DatabaseHandler, _json_dumps
 
 # If you have a real ICount handler module, it will be used; otherwise we mock.
 try:
@@ -33,13 +54,36 @@ except Exception:
                 'message': 'Real ICount provider not configured',
             }
 
+# orjson is optional: when installed it also serves jsonify() (see ORJSONProvider);
+# stored JSON goes through database_handler's _json_dumps either way
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+_year_cache = (0, float('-inf'))  # (year, monotonic time it was read)
+
+
+def _current_year() -> int:
+    # the year only changes at new year; re-read the clock at most once an hour
+    global _year_cache
+    year, read_at = _year_cache
+    now = time.monotonic()
+    if now - read_at < 3600.0:
+        return year
+    year = datetime.now().year
+    _year_cache = (year, now)
+    return year
+
 
 # ==== Logging ================================================================
 logging.basicConfig(
     level=getattr(logging, str(getattr(Config, 'LOG_LEVEL', 'INFO')).upper()),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler(getattr(Config, 'LOG_FILE', 'pbx_system.log'), encoding='utf-8'),
+        # plain append, safe if several processes share the file; opened on first record
+        logging.FileHandler(getattr(Config, 'LOG_FILE', 'pbx_system.log'), encoding='utf-8', delay=True),
         logging.StreamHandler()
     ]
 )
@@ -52,7 +96,10 @@ class MockReceiptProvider:
         self.prefix = prefix
 
     def create_receipt(self, receipt_data: Dict) -> Dict:
-        now = datetime.now().strftime('%Y%m%d%H%M%S')
+        # same digits as strftime('%Y%m%d%H%M%S') without the datetime/strftime overhead
+        t = time.localtime()
+        now = (f"{t.tm_year}{t.tm_mon:02d}{t.tm_mday:02d}"
+               f"{t.tm_hour:02d}{t.tm_min:02d}{t.tm_sec:02d}")
         return {
             'status': True,
             'doc_id': f"{self.prefix}_DOC_{now}",
@@ -61,20 +108,162 @@ class MockReceiptProvider:
         }
 
 
+# ==== In-memory call state ===================================================
+class CallStateStore:
+    """call_id -> מצב השיחה. רשומות שלא נגעו בהן ttl שניות נמחקות, והגודל חסום."""
+
+    def __init__(self, ttl: float = 3600, maxsize: int = 100_000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()  # call_id -> (touched_at, state)
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float):
+        # entries are kept in touch order, so expired ones are at the front
+        while self._data:
+            call_id, (touched_at, _) = next(iter(self._data.items()))
+            if now - touched_at < self.ttl and len(self._data) <= self.maxsize:
+                break
+            del self._data[call_id]
+
+    def _touch(self, call_id: str, state: Dict[str, Any]) -> Dict[str, Any]:
+        now = time.monotonic()
+        self._data[call_id] = (now, state)
+        self._data.move_to_end(call_id)
+        self._expire(now)
+        return state
+
+    def setdefault(self, call_id: str, default: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            entry = self._data.get(call_id)
+            if entry is None or time.monotonic() - entry[0] >= self.ttl:
+                return self._touch(call_id, default)
+            return self._touch(call_id, entry[1])
+
+    def __getitem__(self, call_id: str) -> Dict[str, Any]:
+        # plain lookup for state the caller has just created/touched via setdefault()
+        with self._lock:
+            return self._data[call_id][1]
+
+
 # ==== Flask app ==============================================================
+class ORJSONProvider(DefaultJSONProvider):
+    """jsonify() via orjson; keys stay sorted and output compact like Flask's default"""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return orjson.dumps(
+            obj, default=self.default, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+        ).decode('utf-8')
+
+    def loads(self, s, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+if orjson is not None:
+    app.json = ORJSONProvider(app)
 
 
 # ==== PBX Handler ============================================================
 class PBXHandler:
     def __init__(self):
-        self.db = DatabaseHandler(getattr(Config, 'DATABASE_PATH', 'pbx_system.db'))
+        self.db = DatabaseHandler(_DB_PATH, pool_size=getattr(Config, 'DB_POOL_SIZE', None))
         # choose receipt provider by flag
-        if bool(str(getattr(Config, 'ICOUNT_MOCK', 'true')).lower() == 'true'):
-            self.icount = MockReceiptProvider(prefix=getattr(Config, 'MOCK_RECEIPTS_PREFIX', 'DBG'))
+        if _ICOUNT_MOCK:
+            self.icount = MockReceiptProvider(prefix=_MOCK_PREFIX)
         else:
             self.icount = ICountHandler()
-        self.current_calls: Dict[str, Dict[str, Any]] = {}
+        self.current_calls = CallStateStore(ttl=float(getattr(Config, 'CALL_STATE_TTL', 3600)))
+        # striped locks: requests for the same call never interleave their updates
+        self._call_locks = [threading.RLock() for _ in range(64)]
+        # DTMF inputs not yet written to calls.call_data, flushed in one write
+        # per call on terminal steps and periodically in the background
+        self._dirty_call_state: Dict[str, Dict[str, Any]] = {}
+        self._dirty_lock = threading.Lock()
+        self._flush_attempts: Dict[str, int] = {}  # call_id -> consecutive failed writes
+        self._schedule_call_state_flush()
+        # atexit runs in reverse: ICount jobs finish, call data is flushed, then the DB
+        # closes (running PRAGMA optimize on the writer)
+        atexit.register(self.db.close)
+        atexit.register(self.flush_call_state)
+        # ICount requests run here so callers are not held on the HTTP round trip
+        self._icount_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=8, thread_name_prefix='icount'
+        )
+        atexit.register(self._icount_pool.shutdown)
+        # input name -> handler(call_id, value)
+        self._dispatch = {
+            'newCustomer': self.process_new_customer_choice,
+            'newCustomerID': self.process_new_customer_id,
+            # no renewal handler exists yet; resolved lazily so the error surfaces per call, as before
+            'renewSubscription': lambda call_id, value: self.process_renewal_choice(call_id, value),
+            'mainMenu': self.process_main_menu_choice,
+            'ownerAge': self.process_owner_age,
+            'gender': self.process_gender,
+            'numChildren': self.process_children_count,
+            'customerMessage': self.process_customer_message,
+            'annualReport': self.process_annual_report_choice,
+            # receipt flow
+            'receiptAmount': self.process_receipt_amount,
+            'clientPhone': self.process_client_phone,
+            'clientIdNumber': self.process_client_id,
+            'saveContactChoice': self.process_save_contact_choice,
+            'receiptDescription': self.process_receipt_description,
+        }
+
+    def _lock_for(self, call_id: str) -> threading.RLock:
+        return self._call_locks[hash(call_id) & 63]
+
+    # ---------- call_data persistence ----------
+    def _flush_call_state(self, call_id: str):
+        # under the call lock, so an older batch can never be written over a newer one
+        with self._lock_for(call_id):
+            with self._dirty_lock:
+                pending = self._dirty_call_state.pop(call_id, None)
+            if not pending:
+                return
+            try:
+                self.db.update_call_data(call_id, pending)
+            except Exception:
+                with self._dirty_lock:
+                    attempts = self._flush_attempts.get(call_id, 0) + 1
+                    if attempts >= _CALL_STATE_FLUSH_ATTEMPTS:
+                        self._flush_attempts.pop(call_id, None)
+                    else:
+                        # keep it for the next flush; inputs that arrived meanwhile win
+                        self._flush_attempts[call_id] = attempts
+                        pending.update(self._dirty_call_state.get(call_id, {}))
+                        self._dirty_call_state[call_id] = pending
+                if attempts >= _CALL_STATE_FLUSH_ATTEMPTS:
+                    logger.exception("Dropping call data for %s after %d failed writes: %s",
+                                     call_id, attempts, pending)
+                else:
+                    logger.warning("Failed to persist call data for %s (attempt %d), will retry",
+                                   call_id, attempts)
+            else:
+                if self._flush_attempts:
+                    with self._dirty_lock:
+                        self._flush_attempts.pop(call_id, None)
+
+    def flush_call_state(self):
+        with self._dirty_lock:
+            call_ids = list(self._dirty_call_state)
+        for call_id in call_ids:
+            self._flush_call_state(call_id)
+
+    def _schedule_call_state_flush(self):
+        interval = float(getattr(Config, 'CALL_STATE_FLUSH_INTERVAL', 5))
+        if interval <= 0:
+            return
+        timer = threading.Timer(interval, self._periodic_call_state_flush)
+        timer.daemon = True
+        timer.start()
+
+    def _periodic_call_state_flush(self):
+        try:
+            self.flush_call_state()
+        finally:
+            self._schedule_call_state_flush()
 
     # ---------- utilities ----------
     def get_customer_by_phone(self, phone_number: str) -> Optional[Dict]:
@@ -84,17 +273,7 @@ class PBXHandler:
         return self.db.is_subscription_active(customer)
 
     def show_error_and_return_to_main(self) -> Dict:
-        return {
-            "type": "simpleMenu",
-            "name": "systemError",
-            "times": 1,
-            "timeout": 10,
-            "enabledKeys": "0",
-            "setMusic": "no",
-            "files": [
-                {"text": "אירעה שגיאה במערכת. לחץ 0 לחזרה לתפריט הראשי.", "activatedKeys": "0"}
-            ]
-        }
+        return _SYSTEM_ERROR_MENU
 
     # ---------- profile wizard ----------
     def require_profile_or_main(self, call_id: str, phone: str) -> Dict:
@@ -104,26 +283,13 @@ class PBXHandler:
         if not self.db.is_profile_complete(customer):
             # missing tz_id
             if not customer.get('tz_id'):
-                return {
-                    "type": "getDTMF", "name": "newCustomerID",
-                    "max": 10, "min": 8, "timeout": 30,
-                    "confirmType": "digits", "setMusic": "no",
-                    "files": [{"text": "אנא הקש תעודת זהות (8–10 ספרות).", "activatedKeys": "0,1,2,3,4,5,6,7,8,9"}]
-                }
+                return _ASK_TZ_MENU
             # missing owner_age
             if customer.get('owner_age') is None:
-                return {
-                    "type": "getDTMF", "name": "ownerAge",
-                    "max": 2, "min": 1, "timeout": 20, "confirmType": "number",
-                    "files": [{"text": "אנא הקש גיל בעל העסק (שתי ספרות).", "activatedKeys": "0,1,2,3,4,5,6,7,8,9"}]
-                }
+                return _ASK_OWNER_AGE_MENU
             # missing gender
             if not customer.get('gender'):
-                return {
-                    "type": "simpleMenu", "name": "gender",
-                    "times": 1, "timeout": 15, "enabledKeys": "1,2",
-                    "files": [{"text": "בחר מין: לחץ 1 לזכר, 2 לנקבה.", "activatedKeys": "1,2"}]
-                }
+                return _ASK_GENDER_MENU
             # missing num_children (from details table)
             details = self.db.get_customer_details(customer['id'])
             if not details or details.get('num_children') is None:
@@ -133,64 +299,38 @@ class PBXHandler:
 
     # ---------- input routing ----------
     def handle_user_input(self, call_id: str, input_name: str, input_value: str) -> Dict:
-        # store input
+        with self._lock_for(call_id):
+            return self._handle_user_input(call_id, input_name, input_value)
+
+    def _handle_user_input(self, call_id: str, input_name: str, input_value: str) -> Dict:
+        # store input; the per-call dict is created here once and the
+        # process_* handlers below index it directly
         call_data = self.current_calls.setdefault(call_id, {})
         call_data[input_name] = input_value
-        # persist into calls table json
-        self.db.update_call_data(call_id, {input_name: input_value})
+        # queue for the calls table json; written by _flush_call_state
+        with self._dirty_lock:
+            self._dirty_call_state.setdefault(call_id, {})[input_name] = input_value
 
         # dispatch by input name
-        if input_name == 'newCustomer':
-            return self.process_new_customer_choice(call_id, input_value)
-        elif input_name == 'newCustomerID':
-            return self.process_new_customer_id(call_id, input_value)
-        elif input_name == 'renewSubscription':
-            return self.process_renewal_choice(call_id, input_value)
-        elif input_name == 'mainMenu':
-            return self.process_main_menu_choice(call_id, input_value)
-        elif input_name == 'ownerAge':
-            return self.process_owner_age(call_id, input_value)
-        elif input_name == 'gender':
-            return self.process_gender(call_id, input_value)
-        elif input_name == 'numChildren':
-            return self.process_children_count(call_id, input_value)
-        elif input_name.startswith('child_birth_year_'):
+        handler = self._dispatch.get(input_name)
+        if handler is not None:
+            return handler(call_id, input_value)
+        # handlers that also need the input name
+        if input_name.startswith(_CHILD_BIRTH_PREFIX):
             return self.process_child_birth_year(call_id, input_name, input_value)
-        elif input_name in ('spouse1_workplaces', 'spouse2_workplaces'):
+        if input_name in ('spouse1_workplaces', 'spouse2_workplaces'):
             return self.process_spouse_workplaces(call_id, input_name, input_value)
-        elif input_name == 'customerMessage':
-            return self.process_customer_message(call_id, input_value)
-        elif input_name == 'annualReport':
-            return self.process_annual_report_choice(call_id, input_value)
-        # receipt flow
-        elif input_name == 'receiptAmount':
-            return self.process_receipt_amount(call_id, input_value)
-        elif input_name == 'clientPhone':
-            return self.process_client_phone(call_id, input_value)
-        elif input_name == 'clientIdNumber':
-            return self.process_client_id(call_id, input_value)
-        elif input_name == 'saveContactChoice':
-            return self.process_save_contact_choice(call_id, input_value)
-        elif input_name == 'receiptDescription':
-            return self.process_receipt_description(call_id, input_value)
-        else:
-            logger.warning(f"Unrecognized input: {input_name}={input_value}")
-            return show_main_menu()
+        logger.warning("Unrecognized input: %s=%s", input_name, input_value)
+        return show_main_menu()
 
     # ---------- profile steps ----------
     def process_new_customer_choice(self, call_id: str, choice: str) -> Dict:
         if choice == '1':
-            return {
-                "type": "getDTMF",
-                "name": "newCustomerID",
-                "max": 10, "min": 8, "timeout": 30,
-                "confirmType": "digits", "setMusic": "no",
-                "files": [{"text": "אנא הכנס את מספר הזהות שלך.", "activatedKeys": "0,1,2,3,4,5,6,7,8,9"}]
-            }
+            return _NEW_CUSTOMER_ID_MENU
         return show_main_menu()
 
     def process_new_customer_id(self, call_id: str, tz: str) -> Dict:
-        phone = self.current_calls.get(call_id, {}).get('PBXphone')
+        phone = self.current_calls[call_id].get('PBXphone')
         if not phone:
             return show_main_menu()
         try:
@@ -205,14 +345,10 @@ class PBXHandler:
             return self.require_profile_or_main(call_id, phone)
         except Exception as e:
             logger.exception("Registration failed")
-            return {
-                "type": "simpleMenu", "name": "registrationFail",
-                "times": 1, "timeout": 7, "enabledKeys": "0",
-                "files": [{"text": "הרשמה נכשלה. לחץ 0 לחזרה לתפריט הראשי.", "activatedKeys": "0"}]
-            }
+            return _REGISTRATION_FAIL_MENU
 
     def process_owner_age(self, call_id: str, age: str) -> Dict:
-        phone = self.current_calls.get(call_id, {}).get('PBXphone')
+        phone = self.current_calls[call_id].get('PBXphone')
         try:
             age_i = int(age)
             if age_i < 14 or age_i > 99:
@@ -225,7 +361,7 @@ class PBXHandler:
         return self.require_profile_or_main(call_id, phone)
 
     def process_gender(self, call_id: str, choice: str) -> Dict:
-        phone = self.current_calls.get(call_id, {}).get('PBXphone')
+        phone = self.current_calls[call_id].get('PBXphone')
         val = 'male' if choice == '1' else 'female' if choice == '2' else None
         cust = self.get_customer_by_phone(phone)
         if cust and val:
@@ -257,39 +393,22 @@ class PBXHandler:
             amt = int(amount)
             if amt <= 0:
                 raise ValueError
-            return {
-                "type": "getDTMF", "name": "clientPhone",
-                "max": 11, "min": 9, "timeout": 30, "confirmType": "digits",
-                "files": [{"text": "הקש מספר טלפון של הלקוח (9–11 ספרות).", "activatedKeys": "0,1,2,3,4,5,6,7,8,9"}]
-            }
+            return _ASK_CLIENT_PHONE_MENU
         except ValueError:
-            return {
-                "type": "simpleMenu", "name": "invalidAmount",
-                "times": 1, "timeout": 10, "enabledKeys": "1,0",
-                "files": [{"text": "סכום לא חוקי. לחץ 1 לנסות שוב או 0 לחזרה לתפריט הראשי.", "activatedKeys": "1,0"}]
-            }
+            return _INVALID_AMOUNT_MENU
 
     def process_client_phone(self, call_id: str, phone: str) -> Dict:
-        cd = self.current_calls.setdefault(call_id, {})
+        cd = self.current_calls[call_id]
         cd['client_phone'] = phone
-        return {
-            "type": "getDTMF", "name": "clientIdNumber",
-            "max": 10, "min": 0, "timeout": 20, "confirmType": "digits",
-            "skipKey": "#", "skipValue": "", "setMusic": "no",
-            "files": [{"text": "הקש תעודת זהות של הלקוח או לחץ # לדילוג.", "activatedKeys": "0,1,2,3,4,5,6,7,8,9,#"}]
-        }
+        return _ASK_CLIENT_ID_MENU
 
     def process_client_id(self, call_id: str, tz: str) -> Dict:
-        cd = self.current_calls.setdefault(call_id, {})
+        cd = self.current_calls[call_id]
         cd['client_tz'] = tz or None
-        return {
-            "type": "simpleMenu", "name": "saveContactChoice",
-            "times": 1, "timeout": 15, "enabledKeys": "1,2",
-            "files": [{"text": "לשמור את הלקוח באנשי קשר? לחץ 1 לשמירה, 2 להמשך בלי שמירה.", "activatedKeys": "1,2"}]
-        }
+        return _SAVE_CONTACT_MENU
 
     def process_save_contact_choice(self, call_id: str, choice: str) -> Dict:
-        cd = self.current_calls.get(call_id, {})
+        cd = self.current_calls[call_id]
         issuer_phone = cd.get('PBXphone')
         issuer = self.get_customer_by_phone(issuer_phone)
         if issuer and choice == '1':
@@ -299,15 +418,11 @@ class PBXHandler:
                 tz_id=cd.get('client_tz'),
                 name=None, business_name=None, email=None, notes="added_via_ivr"
             )
-        return {
-            "type": "getDTMF", "name": "receiptDescription",
-            "max": 20, "min": 1, "timeout": 30, "confirmType": "digits",
-            "skipKey": "#", "skipValue": "NO_DESCRIPTION",
-            "files": [{"text": "הקש קוד תיאור קבלה או לחץ # לדילוג.", "activatedKeys": "0,1,2,3,4,5,6,7,8,9,#"}]
-        }
+        return _ASK_RECEIPT_DESCRIPTION_MENU
 
     def process_receipt_description(self, call_id: str, description: str) -> Dict:
-        cd = self.current_calls.get(call_id, {})
+        self._flush_call_state(call_id)
+        cd = self.current_calls[call_id]
         amount = cd.get('receiptAmount')
         issuer_phone = cd.get('PBXphone')
         issuer = self.get_customer_by_phone(issuer_phone)
@@ -333,59 +448,58 @@ class PBXHandler:
         if client_contact_id:
             self.db.update_receipt(receipt_id, client_contact_id=client_contact_id)
 
-        icount_result = self.icount.create_receipt(receipt_data)
-        if icount_result.get('status'):
-            self.db.update_receipt(
-                receipt_id,
-                icount_doc_id=icount_result.get('doc_id'),
-                icount_doc_num=icount_result.get('doc_num'),
-                icount_response=json.dumps(icount_result, ensure_ascii=False),
-                status='completed'
-            )
-            return {
-                "type": "simpleMenu", "name": "receiptSuccess",
-                "times": 1, "timeout": 15, "enabledKeys": "0",
-                "files": [{"text": f"הקבלה נוצרה בהצלחה. מספר: {icount_result.get('doc_num', 'לא זמין')}. לחץ 0 לחזרה לתפריט הראשי.",
-                           "activatedKeys": "0"}]
-            }
-        else:
-            self.db.update_receipt(
-                receipt_id,
-                icount_response=json.dumps(icount_result, ensure_ascii=False),
-                status='failed'
-            )
-            return {
-                "type": "simpleMenu", "name": "receiptFailed",
-                "times": 1, "timeout": 15, "enabledKeys": "1,0",
-                "files": [{"text": "שגיאה ביצירת הקבלה. לחץ 1 לנסות שוב או 0 לתפריט הראשי.", "activatedKeys": "1,0"}]
-            }
+        # ICount is a network call; finish the receipt off the request path
+        self._icount_pool.submit(self._finalize_receipt, receipt_id, receipt_data)
+        return _RECEIPT_QUEUED_MENU
+
+    def _finalize_receipt(self, receipt_id: int, receipt_data: Dict):
+        # runs on the ICount pool, whose futures nobody waits on: log every failure here
+        try:
+            try:
+                icount_result = self.icount.create_receipt(receipt_data)
+            except Exception as e:
+                logger.error("ICount request failed for receipt %s: %s", receipt_id, e)
+                icount_result = {'status': False, 'message': str(e)}
+            if icount_result.get('status'):
+                self.db.update_receipt(
+                    receipt_id,
+                    icount_doc_id=icount_result.get('doc_id'),
+                    icount_doc_num=icount_result.get('doc_num'),
+                    icount_response=_json_dumps(icount_result),
+                    status='completed'
+                )
+                logger.info("Receipt %s completed: %s", receipt_id, icount_result.get('doc_num'))
+            else:
+                self.db.update_receipt(
+                    receipt_id,
+                    icount_response=_json_dumps(icount_result),
+                    status='failed'
+                )
+                logger.warning("Receipt %s failed: %s", receipt_id, icount_result.get('message'))
+        except Exception:
+            logger.exception("Finalizing receipt %s failed; it stays pending", receipt_id)
 
-    # ---------- personal details / benefits ----------
     def process_children_count(self, call_id: str, num_children: str) -> Dict:
         try:
             n = int(num_children)
             if n < 0 or n > 20:
                 raise ValueError
-            cd = self.current_calls.setdefault(call_id, {})
+            cd = self.current_calls[call_id]
             cd['children_count'] = n
             cd['current_child'] = 1
             if n == 0:
                 return self.ask_spouse_workplaces(call_id, 1)
-            return {
-                "type": "getDTMF", "name": "child_birth_year_1",
-                "max": 4, "min": 4, "timeout": 20, "confirmType": "number",
-                "files": [{"text": "אנא הכנס את שנת הלידה של הילד הראשון (4 ספרות).", "activatedKeys": "0,1,2,3,4,5,6,7,8,9"}]
-            }
+            return _ASK_FIRST_CHILD_BIRTH_YEAR_MENU
         except ValueError:
             return self.show_error_and_return_to_main()
 
     def process_child_birth_year(self, call_id: str, input_name: str, birth_year: str) -> Dict:
         try:
             year = int(birth_year)
-            current_year = datetime.now().year
+            current_year = _current_year()
             if year < current_year - 50 or year > current_year:
                 raise ValueError
-            cd = self.current_calls.setdefault(call_id, {})
+            cd = self.current_calls[call_id]
             lst = cd.setdefault('children_birth_years', [])
             lst.append(year)
             current_child = cd.get('current_child', 1)
@@ -393,7 +507,7 @@ class PBXHandler:
             if current_child < total_children:
                 cd['current_child'] = current_child + 1
                 return {
-                    "type": "getDTMF", "name": f"child_birth_year_{current_child + 1}",
+                    "type": "getDTMF", "name": f"{_CHILD_BIRTH_PREFIX}{current_child + 1}",
                     "max": 4, "min": 4, "timeout": 20, "confirmType": "number",
                     "files": [{"text": f"אנא הכנס את שנת הלידה של ילד מספר {current_child + 1} (4 ספרות).", "activatedKeys": "0,1,2,3,4,5,6,7,8,9"}]
                 }
@@ -403,23 +517,19 @@ class PBXHandler:
             return self.show_error_and_return_to_main()
 
     def ask_spouse_workplaces(self, call_id: str, spouse_num: int) -> Dict:
-        spouse_text = "הראשון" if spouse_num == 1 else "השני"
-        return {
-            "type": "getDTMF", "name": f"spouse{spouse_num}_workplaces",
-            "max": 2, "min": 1, "timeout": 20, "confirmType": "number",
-            "files": [{"text": f"אנא הכנס את מספר מקומות העבודה של בן/בת הזוג {spouse_text}.", "activatedKeys": "0,1,2,3,4,5,6,7,8,9"}]
-        }
+        return _ASK_SPOUSE[1 if spouse_num == 1 else 2]
 
     def process_spouse_workplaces(self, call_id: str, input_name: str, workplaces: str) -> Dict:
         try:
             count = int(workplaces)
             if count < 0 or count > 10:
                 raise ValueError
-            cd = self.current_calls.setdefault(call_id, {})
+            cd = self.current_calls[call_id]
             cd[input_name] = count
             if input_name == 'spouse1_workplaces':
                 return self.ask_spouse_workplaces(call_id, 2)
             else:
+                self._flush_call_state(call_id)
                 # persist details
                 phone = cd.get('PBXphone')
                 cust = self.get_customer_by_phone(phone)
@@ -427,42 +537,32 @@ class PBXHandler:
                     self.db.update_customer_details(
                         cust['id'],
                         num_children=cd.get('children_count', 0),
-                        children_birth_years=json.dumps(cd.get('children_birth_years', []), ensure_ascii=False),
+                        children_birth_years=_json_dumps(cd.get('children_birth_years', [])),
                         spouse1_workplaces=cd.get('spouse1_workplaces', 0),
                         spouse2_workplaces=cd.get('spouse2_workplaces', 0)
                     )
-                return {
-                    "type": "simpleMenu", "name": "detailsUpdated",
-                    "times": 1, "timeout": 10, "enabledKeys": "0",
-                    "files": [{"text": "הפרטים עודכנו בהצלחה. לחץ 0 לחזרה לתפריט הראשי.", "activatedKeys": "0"}]
-                }
+                return _DETAILS_UPDATED_MENU
         except ValueError:
             return self.show_error_and_return_to_main()
 
     def process_customer_message(self, call_id: str, message_result: str) -> Dict:
-        cd = self.current_calls.get(call_id, {})
+        self._flush_call_state(call_id)
+        cd = self.current_calls[call_id]
         phone = cd.get('PBXphone')
         cust = self.get_customer_by_phone(phone)
         if cust and message_result:
             self.db.save_message(cust['id'], call_id, message_file=message_result, duration=None)
-        return {
-            "type": "simpleMenu", "name": "messageReceived",
-            "times": 1, "timeout": 10, "enabledKeys": "0",
-            "files": [{"text": "ההודעה התקבלה. נחזור אליך תוך 48 שעות. לחץ 0 לחזרה לתפריט הראשי.", "activatedKeys": "0"}]
-        }
+        return _MESSAGE_RECEIVED_MENU
 
     def process_annual_report_choice(self, call_id: str, choice: str) -> Dict:
+        self._flush_call_state(call_id)
         if choice == '1':
-            cd = self.current_calls.get(call_id, {})
+            cd = self.current_calls[call_id]
             phone = cd.get('PBXphone')
             cust = self.get_customer_by_phone(phone)
             if cust:
                 self.db.request_annual_report(cust['id'])
-            return {
-                "type": "simpleMenu", "name": "reportRequested",
-                "times": 1, "timeout": 10, "enabledKeys": "0",
-                "files": [{"text": "בקשת הדיווח התקבלה. הדיווח יישלח אליך בהודעת SMS תוך 24 שעות. לחץ 0 לחזרה לתפריט הראשי.", "activatedKeys": "0"}]
-            }
+            return _REPORT_REQUESTED_MENU
         return show_main_menu()
 
 
@@ -470,46 +570,62 @@ pbx_handler = PBXHandler()
 
 
 # ==== Routes =================================================================
+# PBX params kept on every call record; _CORE_KEYS are also kept in call state
+_PBX_KEYS = (
+    'PBXphone', 'PBXnum', 'PBXdid', 'PBXcallId', 'PBXcallType',
+    'PBXcallStatus', 'PBXextensionId', 'PBXextensionPath',
+)
+_CORE_KEYS = tuple(k for k in _PBX_KEYS if k != 'PBXcallId')
+# input names looked up, in order, when the value is not under the menu name itself
+_MENU_KEYS = (
+    'newCustomer', 'renewSubscription', 'mainMenu', 'newCustomerID', 'ownerAge', 'gender',
+    'receiptAmount', 'clientPhone', 'clientIdNumber', 'saveContactChoice', 'receiptDescription',
+    'cancelReceiptId', 'numChildren', 'spouse1_workplaces', 'spouse2_workplaces',
+    'annualReport', 'customerMessage',
+)
+# per-child inputs are named child_birth_year_<n>; matched only after a dispatch miss
+_CHILD_BIRTH_PREFIX = 'child_birth_year_'
+
+
+def _json_response(payload: Dict) -> Response:
+    # static menus were serialized once at import; everything else goes through jsonify
+    body = _STATIC_RESPONSES.get(id(payload))
+    if body is None:
+        return jsonify(payload)
+    return Response(body, mimetype='application/json')
+
+
 @app.route('/pbx', methods=['GET'])
 def handle_pbx_request():
     try:
-        # collect params
-        call_params = {
-            'PBXphone': request.args.get('PBXphone'),
-            'PBXnum': request.args.get('PBXnum'),
-            'PBXdid': request.args.get('PBXdid'),
-            'PBXcallId': request.args.get('PBXcallId'),
-            'PBXcallType': request.args.get('PBXcallType'),
-            'PBXcallStatus': request.args.get('PBXcallStatus'),
-            'PBXextensionId': request.args.get('PBXextensionId'),
-            'PBXextensionPath': request.args.get('PBXextensionPath')
-        }
-        # copy extra params as well
+        # collect params in one pass: the known PBX keys (None when absent)
+        # plus any extra non-PBX params
+        call_params = dict.fromkeys(_PBX_KEYS)
         for k, v in request.args.items():
-            if not k.startswith('PBX'):
+            if k in call_params or not k.startswith('PBX'):
                 call_params[k] = v
 
-        logger.info(f"Incoming PBX: {call_params}")
+        logger.info("Incoming PBX: %s", call_params)
         pbx_handler.db.log_call(call_params)
 
         phone = call_params.get('PBXphone')
         call_id = call_params.get('PBXcallId') or ''
         # keep core PBX params in memory for this call
-        core_keys = ['PBXphone','PBXnum','PBXdid','PBXcallType','PBXcallStatus','PBXextensionId','PBXextensionPath']
-        pbx_handler.current_calls.setdefault(call_id, {}).update({k: call_params.get(k) for k in core_keys if call_params.get(k)})
+        with pbx_handler._lock_for(call_id):
+            pbx_handler.current_calls.setdefault(call_id, {}).update({k: call_params[k] for k in _CORE_KEYS if call_params[k]})
 
         if not phone:
             return jsonify({"error": "חסר מספר טלפון"}), 400
 
         customer = pbx_handler.get_customer_by_phone(phone)
         if not customer:
-            return jsonify(handle_new_customer())
+            return _json_response(handle_new_customer())
 
         # subscription check (optional – keep behavior from previous version)
         if not pbx_handler.is_subscription_active(customer):
-            return jsonify(handle_subscription_renewal())
+            return _json_response(handle_subscription_renewal())
 
-        return jsonify(pbx_handler.require_profile_or_main(call_id, phone))
+        return _json_response(pbx_handler.require_profile_or_main(call_id, phone))
     except Exception:
         logger.exception("Error handling /pbx")
         return jsonify({"error": "שגיאה בטיפול בבקשה"}), 500
@@ -520,102 +636,141 @@ def handle_menu_choice(menu_name: str):
     try:
         call_id = request.args.get('PBXcallId') or ''
         # keep core params for flow continuity
-        core_keys = ['PBXphone','PBXnum','PBXdid','PBXcallType','PBXcallStatus','PBXextensionId','PBXextensionPath']
-        core = {k: request.args.get(k) for k in core_keys if request.args.get(k)}
+        args = request.args
+        core = {k: args[k] for k in _CORE_KEYS if args.get(k)}
         if call_id:
-            pbx_handler.current_calls.setdefault(call_id, {}).update(core)
+            with pbx_handler._lock_for(call_id):
+                pbx_handler.current_calls.setdefault(call_id, {}).update(core)
 
         # value may come in parameter named like menu_name, or any of known keys
-        value = request.args.get(menu_name)
+        value = args.get(menu_name)
         if value is None:
-            for k in [
-                'newCustomer','renewSubscription','mainMenu','newCustomerID','ownerAge','gender',
-                'receiptAmount','clientPhone','clientIdNumber','saveContactChoice','receiptDescription',
-                'cancelReceiptId','numChildren','spouse1_workplaces','spouse2_workplaces',
-                'annualReport','customerMessage'
-            ]:
-                if k in request.args:
-                    menu_name, value = k, request.args.get(k)
-                    break
+            # several known keys: the first in _MENU_KEYS order wins
+            k = next((k for k in _MENU_KEYS if k in args), None)
+            if k is not None:
+                menu_name, value = k, args[k]
 
         if not value:
-            return jsonify({
-                "type": "simpleMenu", "name": "invalidChoice",
-                "times": 1, "timeout": 5, "enabledKeys": "0",
-                "files": [{"text": "לא התקבלה בחירה. לחץ 0 לחזרה לתפריט הראשי.", "activatedKeys": "0"}]
-            })
+            return _json_response(_INVALID_CHOICE_MENU)
 
         resp = pbx_handler.handle_user_input(call_id, menu_name, value)
-        return jsonify(resp)
+        return _json_response(resp)
     except Exception:
         logger.exception("Error handling /pbx/menu")
         return jsonify({"error": "שגיאה בטיפול בבחירה"}), 500
 
 
 # ==== Menu helpers ============================================================
+# Static menus are module-level constants; callers must treat them as read-only.
+_SYSTEM_ERROR_MENU = {
+    "type": "simpleMenu",
+    "name": "systemError",
+    "times": 1,
+    "timeout": 10,
+    "enabledKeys": "0",
+    "setMusic": "no",
+    "files": [
+        {"text": "אירעה שגיאה במערכת. לחץ 0 לחזרה לתפריט הראשי.", "activatedKeys": "0"}
+    ]
+}
+
+_INVALID_CHOICE_MENU = {
+    "type": "simpleMenu", "name": "invalidChoice",
+    "times": 1, "timeout": 5, "enabledKeys": "0",
+    "files": [{"text": "לא התקבלה בחירה. לחץ 0 לחזרה לתפריט הראשי.", "activatedKeys": "0"}]
+}
+
+
+_NEW_CUSTOMER_MENU = {
+    "type": "simpleMenu", "name": "newCustomer",
+    "times": 1, "timeout": 10, "enabledKeys": "1,2", "setMusic": "no",
+    "files": [{
+        "text": "שלום וברוך הבא. נראה שאין לך עדיין מנוי במערכת שלנו. לחץ 1 להצטרפות למערכת, או לחץ 2 לחזרה לתפריט הקודם.",
+        "activatedKeys": "1,2"
+    }]
+}
+
+
 def handle_new_customer() -> Dict:
-    return {
-        "type": "simpleMenu", "name": "newCustomer",
-        "times": 1, "timeout": 10, "enabledKeys": "1,2", "setMusic": "no",
-        "files": [{
-            "text": "שלום וברוך הבא. נראה שאין לך עדיין מנוי במערכת שלנו. לחץ 1 להצטרפות למערכת, או לחץ 2 לחזרה לתפריט הקודם.",
-            "activatedKeys": "1,2"
-        }]
-    }
+    return _NEW_CUSTOMER_MENU
+
+
+_RENEW_SUBSCRIPTION_MENU = {
+    "type": "simpleMenu", "name": "renewSubscription",
+    "times": 1, "timeout": 10, "enabledKeys": "1,2", "setMusic": "no",
+    "files": [{
+        "text": "המנוי שלך פג תוקף. לחץ 1 לחידוש המנוי, או לחץ 2 לחזרה לתפריט הקודם.",
+        "activatedKeys": "1,2"
+    }]
+}
 
 
 def handle_subscription_renewal() -> Dict:
-    return {
-        "type": "simpleMenu", "name": "renewSubscription",
-        "times": 1, "timeout": 10, "enabledKeys": "1,2", "setMusic": "no",
-        "files": [{
-            "text": "המנוי שלך פג תוקף. לחץ 1 לחידוש המנוי, או לחץ 2 לחזרה לתפריט הקודם.",
-            "activatedKeys": "1,2"
-        }]
-    }
+    return _RENEW_SUBSCRIPTION_MENU
+
+
+_MAIN_MENU = {
+    "type": "simpleMenu", "name": "mainMenu",
+    "times": 3, "timeout": 15, "enabledKeys": "1,2,3,4,5,6,0", "setMusic": "yes",
+    "files": [{
+        "text": "שלום וברוך הבא למערכת השירותים שלנו. לחץ 1 להנפקת קבלה, לחץ 2 לביטול קבלה, לחץ 3 לעדכון פרטים אישיים, לחץ 4 לשמיעת זכויות מגיעות, לחץ 5 להשארת הודעה, לחץ 6 לבקשת דיווח שנתי, לחץ 0 לחזרה.",
+        "activatedKeys": "1,2,3,4,5,6,0"
+    }]
+}
 
 
 def show_main_menu() -> Dict:
-    return {
-        "type": "simpleMenu", "name": "mainMenu",
-        "times": 3, "timeout": 15, "enabledKeys": "1,2,3,4,5,6,0", "setMusic": "yes",
-        "files": [{
-            "text": "שלום וברוך הבא למערכת השירותים שלנו. לחץ 1 להנפקת קבלה, לחץ 2 לביטול קבלה, לחץ 3 לעדכון פרטים אישיים, לחץ 4 לשמיעת זכויות מגיעות, לחץ 5 להשארת הודעה, לחץ 6 לבקשת דיווח שנתי, לחץ 0 לחזרה.",
-            "activatedKeys": "1,2,3,4,5,6,0"
-        }]
-    }
+    return _MAIN_MENU
+
+
+_CREATE_RECEIPT_MENU = {
+    "type": "getDTMF", "name": "receiptAmount",
+    "max": 7, "min": 1, "timeout": 30, "confirmType": "number",
+    "files": [{"text": "הקש סכום קבלה בשקלים (ללא אגורות).", "activatedKeys": "0,1,2,3,4,5,6,7,8,9"}]
+}
 
 
 def handle_create_receipt() -> Dict:
-    return {
-        "type": "getDTMF", "name": "receiptAmount",
-        "max": 7, "min": 1, "timeout": 30, "confirmType": "number",
-        "files": [{"text": "הקש סכום קבלה בשקלים (ללא אגורות).", "activatedKeys": "0,1,2,3,4,5,6,7,8,9"}]
-    }
+    return _CREATE_RECEIPT_MENU
+
+
+_CANCEL_RECEIPT_MENU = {
+    "type": "getDTMF", "name": "cancelReceiptId",
+    "max": 10, "min": 1, "timeout": 30, "confirmType": "digits",
+    "files": [{"text": "אנא הכנס את מספר הקבלה לביטול.", "activatedKeys": "0,1,2,3,4,5,6,7,8,9"}]
+}
 
 
 def handle_cancel_receipt() -> Dict:
-    return {
-        "type": "getDTMF", "name": "cancelReceiptId",
-        "max": 10, "min": 1, "timeout": 30, "confirmType": "digits",
-        "files": [{"text": "אנא הכנס את מספר הקבלה לביטול.", "activatedKeys": "0,1,2,3,4,5,6,7,8,9"}]
-    }
+    return _CANCEL_RECEIPT_MENU
+
+
+_RECEIPT_QUEUED_MENU = {
+    "type": "simpleMenu", "name": "receiptQueued",
+    "times": 1, "timeout": 15, "enabledKeys": "0",
+    "files": [{"text": "הקבלה התקבלה ונמצאת בהפקה. לחץ 0 לחזרה לתפריט הראשי.", "activatedKeys": "0"}]
+}
+
+_UPDATE_DETAILS_MENU = {
+    "type": "getDTMF", "name": "numChildren",
+    "max": 2, "min": 1, "timeout": 20, "confirmType": "number",
+    "files": [{"text": "אנא הכנס את מספר הילדים.", "activatedKeys": "0,1,2,3,4,5,6,7,8,9"}]
+}
 
 
 def handle_update_personal_details() -> Dict:
-    return {
-        "type": "getDTMF", "name": "numChildren",
-        "max": 2, "min": 1, "timeout": 20, "confirmType": "number",
-        "files": [{"text": "אנא הכנס את מספר הילדים.", "activatedKeys": "0,1,2,3,4,5,6,7,8,9"}]
-    }
+    return _UPDATE_DETAILS_MENU
+
+
+_BENEFITS_MENU = {
+    "type": "simpleMenu", "name": "benefitsMenu",
+    "times": 1, "timeout": 30, "enabledKeys": "1,0",
+    "files": [{"text": "על בסיס הנתונים שלך, אתה זכאי למענק עבודה בסך 2000 שקל ולדמי לידה בסך 1500 שקל. לחץ 1 לפרטים נוספים או 0 לחזרה לתפריט הראשי.", "activatedKeys": "1,0"}]
+}
 
 
 def handle_show_benefits() -> Dict:
-    return {
-        "type": "simpleMenu", "name": "benefitsMenu",
-        "times": 1, "timeout": 30, "enabledKeys": "1,0",
-        "files": [{"text": "על בסיס הנתונים שלך, אתה זכאי למענק עבודה בסך 2000 שקל ולדמי לידה בסך 1500 שקל. לחץ 1 לפרטים נוספים או 0 לחזרה לתפריט הראשי.", "activatedKeys": "1,0"}]
-    }
+    return _BENEFITS_MENU
 
 
 def handle_leave_message() -> Dict:
@@ -627,14 +782,133 @@ def handle_leave_message() -> Dict:
     }
 
 
+_ANNUAL_REPORT_MENU = {
+    "type": "simpleMenu", "name": "annualReport",
+    "times": 1, "timeout": 15, "enabledKeys": "1,0",
+    "files": [{"text": "הדיווח השנתי שלך יישלח אליך בהודעת SMS תוך 24 שעות. לחץ 1 לאישור או 0 לביטול.", "activatedKeys": "1,0"}]
+}
+
+
 def handle_annual_report() -> Dict:
-    return {
-        "type": "simpleMenu", "name": "annualReport",
-        "times": 1, "timeout": 15, "enabledKeys": "1,0",
-        "files": [{"text": "הדיווח השנתי שלך יישלח אליך בהודעת SMS תוך 24 שעות. לחץ 1 לאישור או 0 לביטול.", "activatedKeys": "1,0"}]
+    return _ANNUAL_REPORT_MENU
+
+
+# prompts returned by the PBXHandler flow methods
+_ASK_TZ_MENU = {
+    "type": "getDTMF", "name": "newCustomerID",
+    "max": 10, "min": 8, "timeout": 30,
+    "confirmType": "digits", "setMusic": "no",
+    "files": [{"text": "אנא הקש תעודת זהות (8–10 ספרות).", "activatedKeys": "0,1,2,3,4,5,6,7,8,9"}]
+}
+
+_ASK_OWNER_AGE_MENU = {
+    "type": "getDTMF", "name": "ownerAge",
+    "max": 2, "min": 1, "timeout": 20, "confirmType": "number",
+    "files": [{"text": "אנא הקש גיל בעל העסק (שתי ספרות).", "activatedKeys": "0,1,2,3,4,5,6,7,8,9"}]
+}
+
+_ASK_GENDER_MENU = {
+    "type": "simpleMenu", "name": "gender",
+    "times": 1, "timeout": 15, "enabledKeys": "1,2",
+    "files": [{"text": "בחר מין: לחץ 1 לזכר, 2 לנקבה.", "activatedKeys": "1,2"}]
+}
+
+_NEW_CUSTOMER_ID_MENU = {
+    "type": "getDTMF",
+    "name": "newCustomerID",
+    "max": 10, "min": 8, "timeout": 30,
+    "confirmType": "digits", "setMusic": "no",
+    "files": [{"text": "אנא הכנס את מספר הזהות שלך.", "activatedKeys": "0,1,2,3,4,5,6,7,8,9"}]
+}
+
+_REGISTRATION_FAIL_MENU = {
+    "type": "simpleMenu", "name": "registrationFail",
+    "times": 1, "timeout": 7, "enabledKeys": "0",
+    "files": [{"text": "הרשמה נכשלה. לחץ 0 לחזרה לתפריט הראשי.", "activatedKeys": "0"}]
+}
+
+_ASK_CLIENT_PHONE_MENU = {
+    "type": "getDTMF", "name": "clientPhone",
+    "max": 11, "min": 9, "timeout": 30, "confirmType": "digits",
+    "files": [{"text": "הקש מספר טלפון של הלקוח (9–11 ספרות).", "activatedKeys": "0,1,2,3,4,5,6,7,8,9"}]
+}
+
+_INVALID_AMOUNT_MENU = {
+    "type": "simpleMenu", "name": "invalidAmount",
+    "times": 1, "timeout": 10, "enabledKeys": "1,0",
+    "files": [{"text": "סכום לא חוקי. לחץ 1 לנסות שוב או 0 לחזרה לתפריט הראשי.", "activatedKeys": "1,0"}]
+}
+
+_ASK_CLIENT_ID_MENU = {
+    "type": "getDTMF", "name": "clientIdNumber",
+    "max": 10, "min": 0, "timeout": 20, "confirmType": "digits",
+    "skipKey": "#", "skipValue": "", "setMusic": "no",
+    "files": [{"text": "הקש תעודת זהות של הלקוח או לחץ # לדילוג.", "activatedKeys": "0,1,2,3,4,5,6,7,8,9,#"}]
+}
+
+_SAVE_CONTACT_MENU = {
+    "type": "simpleMenu", "name": "saveContactChoice",
+    "times": 1, "timeout": 15, "enabledKeys": "1,2",
+    "files": [{"text": "לשמור את הלקוח באנשי קשר? לחץ 1 לשמירה, 2 להמשך בלי שמירה.", "activatedKeys": "1,2"}]
+}
+
+_ASK_RECEIPT_DESCRIPTION_MENU = {
+    "type": "getDTMF", "name": "receiptDescription",
+    "max": 20, "min": 1, "timeout": 30, "confirmType": "digits",
+    "skipKey": "#", "skipValue": "NO_DESCRIPTION",
+    "files": [{"text": "הקש קוד תיאור קבלה או לחץ # לדילוג.", "activatedKeys": "0,1,2,3,4,5,6,7,8,9,#"}]
+}
+
+_ASK_FIRST_CHILD_BIRTH_YEAR_MENU = {
+    "type": "getDTMF", "name": "child_birth_year_1",
+    "max": 4, "min": 4, "timeout": 20, "confirmType": "number",
+    "files": [{"text": "אנא הכנס את שנת הלידה של הילד הראשון (4 ספרות).", "activatedKeys": "0,1,2,3,4,5,6,7,8,9"}]
+}
+
+_ASK_SPOUSE = {
+    num: {
+        "type": "getDTMF", "name": f"spouse{num}_workplaces",
+        "max": 2, "min": 1, "timeout": 20, "confirmType": "number",
+        "files": [{"text": f"אנא הכנס את מספר מקומות העבודה של בן/בת הזוג {spouse_text}.", "activatedKeys": "0,1,2,3,4,5,6,7,8,9"}]
     }
+    for num, spouse_text in ((1, "הראשון"), (2, "השני"))
+}
+
+_DETAILS_UPDATED_MENU = {
+    "type": "simpleMenu", "name": "detailsUpdated",
+    "times": 1, "timeout": 10, "enabledKeys": "0",
+    "files": [{"text": "הפרטים עודכנו בהצלחה. לחץ 0 לחזרה לתפריט הראשי.", "activatedKeys": "0"}]
+}
+
+_MESSAGE_RECEIVED_MENU = {
+    "type": "simpleMenu", "name": "messageReceived",
+    "times": 1, "timeout": 10, "enabledKeys": "0",
+    "files": [{"text": "ההודעה התקבלה. נחזור אליך תוך 48 שעות. לחץ 0 לחזרה לתפריט הראשי.", "activatedKeys": "0"}]
+}
+
+_REPORT_REQUESTED_MENU = {
+    "type": "simpleMenu", "name": "reportRequested",
+    "times": 1, "timeout": 10, "enabledKeys": "0",
+    "files": [{"text": "בקשת הדיווח התקבלה. הדיווח יישלח אליך בהודעת SMS תוך 24 שעות. לחץ 0 לחזרה לתפריט הראשי.", "activatedKeys": "0"}]
+}
+
+
+# pre-serialized bodies for the static menus, keyed by object identity
+_STATIC_RESPONSES: Dict[int, bytes] = {
+    id(menu): app.json.response(menu).get_data()
+    for menu in (
+        _SYSTEM_ERROR_MENU, _INVALID_CHOICE_MENU, _NEW_CUSTOMER_MENU, _RENEW_SUBSCRIPTION_MENU,
+        _MAIN_MENU, _CREATE_RECEIPT_MENU, _CANCEL_RECEIPT_MENU, _UPDATE_DETAILS_MENU,
+        _RECEIPT_QUEUED_MENU, _BENEFITS_MENU, _ANNUAL_REPORT_MENU,
+        _ASK_TZ_MENU, _ASK_OWNER_AGE_MENU, _ASK_GENDER_MENU, _NEW_CUSTOMER_ID_MENU,
+        _REGISTRATION_FAIL_MENU, _ASK_CLIENT_PHONE_MENU, _INVALID_AMOUNT_MENU, _ASK_CLIENT_ID_MENU,
+        _SAVE_CONTACT_MENU, _ASK_RECEIPT_DESCRIPTION_MENU, _ASK_FIRST_CHILD_BIRTH_YEAR_MENU, _DETAILS_UPDATED_MENU,
+        _MESSAGE_RECEIVED_MENU, _REPORT_REQUESTED_MENU, *_ASK_SPOUSE.values(),
+    )
+}
 
 
 if __name__ == '__main__':
     # DO NOT seed demo data here in production.
-    app.run(host=getattr(Config, 'HOST', '0.0.0.0'), port=int(getattr(Config, 'PORT', 5000)), debug=bool(str(getattr(Config, 'DEBUG', 'true')).lower() == 'true'))
+    app.run(host=getattr(Config, 'HOST', '0.0.0.0'), port=int(getattr(Config, 'PORT', 5000)), debug=_DEBUG,
+            threaded=True)
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# pbx_server builds its handler at import time; point it at a throwaway database/log
+_tmp = tempfile.mkdtemp(prefix='ivr-tests-')
+os.environ.setdefault('DATABASE_PATH', os.path.join(_tmp, 'pbx_test.db'))
+os.environ.setdefault('LOG_FILE', os.path.join(_tmp, 'pbx_test.log'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
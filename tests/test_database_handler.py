@@ -0,0 +1,61 @@
+from contextlib import contextmanager
+from datetime import date
+
+import pytest
+
+from database_handler import DatabaseHandler, _add_months
+
+
+@pytest.fixture
+def db(tmp_path):
+    handler = DatabaseHandler(str(tmp_path / 'handler_test.db'))
+    yield handler
+    handler.close()
+
+
+def test_writes_for_unlogged_call_are_accepted(db):
+    # menu callbacks may arrive for calls /pbx never logged, or without PBXcallId
+    assert db.create_receipt(1, '', {'amount': 5})
+    assert db.save_message(1, 'never-logged', message_file='m.wav')
+    assert db.update_customer_details(999, num_children=1)
+
+
+def test_customer_read_racing_an_invalidation_is_not_cached(db, monkeypatch):
+    read_conn = db._read_conn
+
+    @contextmanager
+    def racing_read_conn():
+        with read_conn() as conn:
+            # a writer commits and invalidates while this read is in flight
+            db._invalidate_customer(phone_number='0500000001')
+            yield conn
+
+    monkeypatch.setattr(db, '_read_conn', racing_read_conn)
+    assert db.get_customer_by_phone('0500000001') is None
+    assert '0500000001' not in db._cust_cache
+    monkeypatch.undo()
+
+    customer_id = db.create_customer('0500000001')
+    assert db.get_customer_by_phone('0500000001')['id'] == customer_id
+
+
+@pytest.mark.parametrize('start, months, expected', [
+    (date(2025, 1, 31), 1, date(2025, 2, 28)),    # clamped to the shorter month
+    (date(2024, 2, 29), 12, date(2025, 2, 28)),   # leap day into a non-leap year
+    (date(2025, 12, 15), 1, date(2026, 1, 15)),   # rolls over into the next year
+])
+def test_add_months(start, months, expected):
+    assert _add_months(start, months) == expected
+
+
+def test_repeat_annual_report_request_keeps_report_file(db):
+    customer_id = db.create_customer('0500000002')
+    rid = db.request_annual_report(customer_id, 2024)
+    with db._write_conn() as conn:
+        conn.execute("UPDATE annual_reports SET report_file = 'r2024.pdf', status = 'sent' WHERE id = ?", (rid,))
+
+    assert db.request_annual_report(customer_id, 2024) == rid
+    with db._read_conn() as conn:
+        row = conn.execute('SELECT id, report_file, status FROM annual_reports WHERE customer_id = ?',
+                           (customer_id,)).fetchall()
+    assert [tuple(r) for r in row] == [(rid, 'r2024.pdf', 'requested')]
@@ -0,0 +1,68 @@
+import threading
+
+import pytest
+
+import pbx_server
+
+
+@pytest.fixture
+def client():
+    return pbx_server.app.test_client()
+
+
+def test_menu_value_found_under_known_key(client):
+    # the value is not under the menu name, so the known-key fallback routes it
+    resp = client.get('/pbx/menu/x', query_string={'PBXcallId': 'menu-fallback', 'spouse1_workplaces': '1'})
+    assert resp.status_code == 200
+    assert resp.get_json()['name'] == 'spouse2_workplaces'
+
+
+def test_menu_fallback_prefers_first_known_key(client):
+    resp = client.get('/pbx/menu/x', query_string={
+        'PBXcallId': 'menu-order', 'spouse2_workplaces': '2', 'spouse1_workplaces': '1',
+    })
+    assert resp.status_code == 200
+    # spouse1_workplaces comes first in _MENU_KEYS, so we are asked about spouse 2
+    assert resp.get_json()['name'] == 'spouse2_workplaces'
+
+
+def test_menu_without_value_is_invalid_choice(client):
+    resp = client.get('/pbx/menu/x', query_string={'PBXcallId': 'menu-empty'})
+    assert resp.status_code == 200
+    assert resp.get_json()['name'] == 'invalidChoice'
+
+
+def _queue_call_data(call_id, data):
+    handler = pbx_server.pbx_handler
+    with handler._dirty_lock:
+        handler._dirty_call_state.setdefault(call_id, {}).update(data)
+
+
+def test_call_state_flush_waits_for_call_lock():
+    handler = pbx_server.pbx_handler
+    _queue_call_data('flush-lock', {'mainMenu': '1'})
+    with handler._lock_for('flush-lock'):
+        flusher = threading.Thread(target=handler._flush_call_state, args=('flush-lock',))
+        flusher.start()
+        flusher.join(0.2)
+        # the background flush must not take the batch while a request holds the call
+        assert flusher.is_alive()
+        assert 'flush-lock' in handler._dirty_call_state
+    flusher.join(5)
+    assert 'flush-lock' not in handler._dirty_call_state
+
+
+def test_failing_call_state_flush_is_dropped_after_retries(monkeypatch):
+    handler = pbx_server.pbx_handler
+
+    def fail(call_id, data):
+        raise RuntimeError('db unavailable')
+
+    monkeypatch.setattr(handler.db, 'update_call_data', fail)
+    _queue_call_data('flush-fail', {'mainMenu': '1'})
+    for _ in range(pbx_server._CALL_STATE_FLUSH_ATTEMPTS - 1):
+        handler._flush_call_state('flush-fail')
+        assert 'flush-fail' in handler._dirty_call_state
+    handler._flush_call_state('flush-fail')
+    assert 'flush-fail' not in handler._dirty_call_state
+    assert 'flush-fail' not in handler._flush_attempts